@@ -159,6 +159,21 @@ REST_FRAMEWORK = {
 # Celery settings - configure in production
 CELERY_BROKER_URL = os.getenv('CELERY_BROKER_URL', 'redis://localhost:6379/0')
 CELERY_RESULT_BACKEND = os.getenv('CELERY_RESULT_BACKEND', 'redis://localhost:6379/0')
+CELERY_TASK_COMPRESSION = 'gzip'
+CELERY_RESULT_COMPRESSION = 'gzip'
+# Tasks are acked late, so a worker only reserves the task it is running
+CELERY_WORKER_PREFETCH_MULTIPLIER = 1
+# Vision calls are I/O-bound and parsing is CPU-bound, so they get separate queues.
+# A worker only consumes the queues it is given, so a single worker needs all of them:
+#   celery -A core worker -Q celery,ocr,parse
+# or, split by workload:
+#   celery -A core worker -Q ocr --concurrency=32
+#   celery -A core worker -Q celery,parse
+CELERY_TASK_ROUTES = {
+    'invoices.tasks.run_ocr_on_invoice': {'queue': 'ocr'},
+    'invoices.tasks.run_ocr_on_invoices': {'queue': 'ocr'},
+    'invoices.parsers.parse_invoice_data': {'queue': 'parse'},
+}
 
 # AWS S3 settings - configure in production
 AWS_ACCESS_KEY_ID = os.getenv('AWS_ACCESS_KEY_ID', '')
@@ -1,9 +1,163 @@
-import re
+import functools
 import logging
 from datetime import datetime
 
+try:
+    # pyre2 wraps Google's RE2: linear-time matching with no backtracking,
+    # and a drop-in replacement for the subset of `re` used below.
+    import re2 as re
+except ImportError:
+    import re
+
+try:
+    import pcre2
+except ImportError:
+    pcre2 = None
+
+try:
+    import hyperscan
+except ImportError:
+    hyperscan = None
+
 logger = logging.getLogger(__name__)
 
+_FLAGS = re.IGNORECASE | re.MULTILINE
+
+
+def _compile_all(patterns):
+    return tuple(re.compile(p, _FLAGS) for p in patterns)
+
+
+# Regex patterns are compiled once at import time so the parse_* methods only
+# dispatch to the compiled matchers instead of going through re's cache.
+_GSTIN = r"[0-9]{2}[A-Z]{5}[0-9]{4}[A-Z]{1}[1-9A-Z]{1}Z[0-9A-Z]{1}"
+_GSTIN_RE = re.compile(_GSTIN, _FLAGS)
+
+# Each field's alternatives are fused into one pattern with a single capture
+# group, so a field costs one scan over the OCR text. That scan covers the whole
+# text rather than one line at a time, so the whitespace in these patterns is
+# [ \t] (never \s): a label and its value have to be on the same line.
+_INVOICE_NUMBER_RE = re.compile(
+    r"(?:INVOICE(?:[ \t]*NO\.?|[ \t]*NUMBER)?|INV(?:[ \t]*NO)?[.:# \t]|BILL[ \t]*NO\.?|TAX[ \t]*INVOICE)"
+    r"[ \t]*[:#]?[ \t]*([A-Z0-9\-/]+)",
+    _FLAGS,
+)
+
+_INVOICE_DATE_RE = re.compile(
+    r"(?:(?:INVOICE|BILL)?[ \t]*DATE[ \t]*[:.]?[ \t]*)?"
+    r"(\d{1,2}[/\.-]\d{1,2}[/\.-]\d{2,4})",
+    _FLAGS,
+)
+
+_SELLER_GSTIN_RE = re.compile(
+    rf"(?:SELLER[ \t]*GSTIN|GSTIN|GST[ \t]*NO\.?|GST)[ \t]*[:.]?[ \t]*({_GSTIN})",
+    _FLAGS,
+)
+
+# Prioritize finding "BILL TO", "CONSIGNEE", "CUSTOMER NAME" followed by a name.
+# The name itself is kept on one line (spaces and tabs only).
+_BUYER_NAME_RE = re.compile(
+    r"(?:BILL[ \t]*TO|CONSIGNEE|CUSTOMER[ \t]*NAME|BUYER[ \t]*NAME|TO)[ \t]*[:-]?[ \t]*"
+    r"([A-Z0-9 \t&\.,-]+)",
+    _FLAGS,
+)
+
+# If none of the above, try a general name pattern (less reliable)
+_GENERAL_NAME_RE = re.compile(
+    r"(?:ATTN:|M/S\.?)[ \t]*([A-Z0-9 \t&\.,-]+)",
+    _FLAGS,
+)
+
+# Strips a trailing "State, CODE: NN" fragment from a captured buyer name
+_STATE_CODE_RE = re.compile(r',?[ \t]*(?:[A-Z][a-z]+,[ \t]*CODE:[ \t]*\d{2})')
+
+_TOTAL_TAX_RE = re.compile(
+    r"(?:TOTAL[ \t]*TAX|TAX[ \t]*AMOUNT|GST[ \t]*AMOUNT|TAX[ \t]*TOTAL|TOTAL[ \t]*GST|SGST[ \t]*\+[ \t]*CGST|IGST)"
+    r"[ \t]*[:.]?[ \t]*(?:RS\.?|INR)?[ \t]*([0-9]+\.[0-9]{2})",
+    _FLAGS,
+)
+
+_GRAND_TOTAL_RE = re.compile(
+    r"(?:GRAND[ \t]*TOTAL|NET[ \t]*AMOUNT|TOTAL[ \t]*AMOUNT|AMOUNT[ \t]*PAYABLE|TOTAL[ \t]*VALUE"
+    r"|AMOUNT[ \t]*IN[ \t]*FIGURES|BALANCE[ \t]*DUE|TOTAL)"
+    r"[ \t]*[:.]?[ \t]*(?:RS\.?|INR)?[ \t]*([0-9]+(?:,[0-9]{3})*\.[0-9]{2})",
+    _FLAGS,
+)
+
+# Prioritize amounts carrying the rupee symbol, then 'RS.' or 'INR'
+_RUPEE_SYMBOL_PATTERNS = _compile_all((
+    r"₹[ \t]*([0-9]+(?:,[0-9]{3})*\.[0-9]{2})",
+    r"(?:RS\.?|INR)[ \t]*([0-9]+(?:,[0-9]{3})*\.[0-9]{2})",
+))
+
+# Regex-based line item parsing: attempts to capture common line item patterns
+# The pattern is run with finditer over the whole text: "^.*?" takes the first
+# match on each line and the separators are spaces and tabs only, so a match
+# never spans two lines. (Not \s, and not \v either: in PCRE2 \v is any
+# vertical whitespace, newlines included.)
+_LINE_ITEM_PATTERN = (
+    r"^.*?"
+    r"(\d+)[ \t]+" # Item number (group 1)
+    r"(.+?)[ \t]+" # Description (group 2, non-greedy)
+    r"([A-Z0-9]{4,8})?[ \t]*" # HSN/SAC (optional, group 3)
+    r"(\d+\.?\d*)[ \t]+" # Quantity (group 4)
+    r"(\d+\.?\d*)[ \t]+" # Rate (group 5)
+    r"(\d+\.?\d*)[ \t]+" # Taxable Value (group 6)
+    r"(\d+\.?\d*)?" # Tax Percentage (optional, group 7)
+    r"(\d+\.?\d*)" # Total (group 8)
+)
+
+# This is the heaviest pattern in the module and runs against every line, so
+# it is JIT-compiled to native code by PCRE2 when the binding is installed.
+if pcre2 is not None:
+    _LINE_ITEM_RE = pcre2.compile(_LINE_ITEM_PATTERN, pcre2.IGNORECASE | pcre2.MULTILINE, jit=True)
+else:
+    _LINE_ITEM_RE = re.compile(_LINE_ITEM_PATTERN, _FLAGS)
+
+# With Hyperscan installed, the single-match field patterns are also compiled
+# into one multi-pattern database. A parser scans its text with it once, notes
+# where each pattern's leftmost match starts, and then runs the compiled pattern
+# only from that offset (or not at all if Hyperscan found no match), so a
+# missing field no longer costs a full scan of the text.
+_SCANNED_PATTERNS = (
+    _INVOICE_NUMBER_RE,
+    _INVOICE_DATE_RE,
+    _SELLER_GSTIN_RE,
+    _BUYER_NAME_RE,
+    _GENERAL_NAME_RE,
+    _TOTAL_TAX_RE,
+    _GRAND_TOTAL_RE,
+    *_RUPEE_SYMBOL_PATTERNS,
+)
+if hyperscan is not None:
+    _SCAN_DB = hyperscan.Database()
+    _SCAN_DB.compile(
+        expressions=[p.pattern.encode('utf-8') for p in _SCANNED_PATTERNS],
+        ids=list(range(len(_SCANNED_PATTERNS))),
+        elements=len(_SCANNED_PATTERNS),
+        flags=[
+            hyperscan.HS_FLAG_CASELESS | hyperscan.HS_FLAG_MULTILINE | hyperscan.HS_FLAG_SOM_LEFTMOST
+            | hyperscan.HS_FLAG_UTF8 | hyperscan.HS_FLAG_UCP
+        ] * len(_SCANNED_PATTERNS),
+    )
+else:
+    _SCAN_DB = None
+
+
+def _memo(key):
+    """Cache a parse_* result in self.extracted_fields under `key`."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(self):
+            if key in self.extracted_fields:
+                return self.extracted_fields[key]
+            value = fn(self)
+            self.extracted_fields[key] = value
+            return value
+        return wrapper
+    return decorator
+
+
 class InvoiceFieldParser:
     """
     A utility class to parse specific invoice fields from raw OCR text
@@ -15,10 +169,12 @@ class InvoiceFieldParser:
         ocr_data:        full_text_annotation.text from Vision AI
         ocr_json:        optional Vision AI response object (so we can grab tables if available)
         """
-        self.ocr_text = ocr_data.get('text', '').upper()
+        # The text is kept as-is: every pattern is compiled case-insensitively,
+        # so an upper-cased copy is not needed.
+        self.ocr_text = ocr_data.get('text', '')
         self.ocr_json = ocr_json
-        self.lines = self.ocr_text.split('\n')
         self.extracted_fields = {}
+        self._match_starts = None
         logger.info(f"Initialized InvoiceFieldParser with OCR Text (first 500 chars): {self.ocr_text[:500]}")
         logger.info(f"OCR JSON presence: {'Yes' if self.ocr_json else 'No'}")
 
@@ -33,23 +189,15 @@ class InvoiceFieldParser:
         logger.debug(f"No match found for patterns: {regex_patterns}")
         return None
 
+    @_memo("invoice_number")
     def parse_invoice_number(self):
-        patterns = [
-            r"INVOICE(?:\s*NO\.?|\s*NUMBER)?\s*[:#]?\s*([A-Z0-9\-/]+)",
-            r"INV(?:\s*NO)?\.?\s*[:#]?\s*([A-Z0-9\-/]+)",
-            r"BILL\s*NO\.?\s*[:#]?\s*([A-Z0-9\-/]+)",
-            r"TAX\s*INVOICE\s*[:#]?\s*([A-Z0-9\-/]+)",
-        ]
-        return self._find_first_match(patterns, "invoice_number")
+        invoice_number = self._find_first_match(_INVOICE_NUMBER_RE, "invoice_number")
+        # Matching ignores case, so normalise what the OCR read
+        return invoice_number.upper() if invoice_number else None
 
+    @_memo("invoice_date")
     def parse_invoice_date(self):
-        patterns = [
-            r"DATE\s*[:.]?\s*(\d{1,2}[/\.-]\d{1,2}[/\.-]\d{2,4})",
-            r"INVOICE\s*DATE\s*[:.]?\s*(\d{1,2}[/\.-]\d{1,2}[/\.-]\d{2,4})",
-            r"BILL\s*DATE\s*[:.]?\s*(\d{1,2}[/\.-]\d{1,2}[/\.-]\d{2,4})",
-            r"(\d{1,2}[/\.-]\d{1,2}[/\.-]\d{2,4})" # General date pattern
-        ]
-        date_str = self._find_first_match(patterns)
+        date_str = self._find_first_match(_INVOICE_DATE_RE)
         if date_str:
             try:
                 # Try parsing with common formats
@@ -65,38 +213,32 @@ class InvoiceFieldParser:
                 return None
         return None
 
+    @_memo("seller_gstin")
     def parse_seller_gstin(self):
-        patterns = [
-            r"SELLER\s*GSTIN\s*[:.]?\s*([0-9]{2}[A-Z]{5}[0-9]{4}[A-Z]{1}[1-9A-Z]{1}Z[0-9A-Z]{1})",
-            r"GSTIN\s*[:.]?\s*([0-9]{2}[A-Z]{5}[0-9]{4}[A-Z]{1}[1-9A-Z]{1}Z[0-9A-Z]{1})",
-            r"GST\s*NO\.?\s*[:.]?\s*([0-9]{2}[A-Z]{5}[0-9]{4}[A-Z]{1}[1-9A-Z]{1}Z[0-9A-Z]{1})",
-            r"GST\s*([0-9]{2}[A-Z]{5}[0-9]{4}[A-Z]{1}[1-9A-Z]{1}Z[0-9A-Z]{1})",
-        ]
-        return self._find_first_match(patterns, "seller_gstin")
+        gstin = self._find_first_match(_SELLER_GSTIN_RE, "seller_gstin")
+        return gstin.upper() if gstin else None
 
+    @_memo("buyer_name")
     def parse_buyer_name(self):
-        # Prioritize finding "BILL TO", "CONSIGNEE", "CUSTOMER NAME" followed by a name
-        patterns = [
-            r"(?:BILL\s*TO|CONSIGNEE|CUSTOMER\s*NAME)\s*[:-]?\s*([A-Z0-9\s&\.,-]+)",
-            r"BUYER\s*NAME\s*[:-]?\s*([A-Z0-9\s&\.,-]+)",
-            r"TO\s*[:]?\s*([A-Z0-9\s&\.,-]+)",
-        ]
-        
         # Try to find buyer name based on common patterns
-        buyer_name = self._find_first_match(patterns)
+        buyer_name = self._find_first_match(_BUYER_NAME_RE)
         if buyer_name:
             # Further refinement: remove state/code if captured
-            buyer_name = re.sub(r',?\s*(?:[A-Z][a-z]+,\s*CODE:\s*\d{2})', '', buyer_name).strip()
+            buyer_name = _STATE_CODE_RE.sub('', buyer_name).strip()
             return buyer_name
         
         # Fallback: if 'BILL TO' etc. not found, try to locate names near GSTIN
         # This is a more complex heuristic and might require positional analysis from ocr_json
         if self.ocr_json:
-            for page in self.ocr_json.get('pages', []):
-                for block in page.get('blocks', []):
-                    for paragraph in block.get('paragraphs', []):
-                        para_text = ''.join([symbol.get('text', '') for word in paragraph.get('words', []) for symbol in word.get('symbols', [])])
-                        if re.search(r'[0-9]{2}[A-Z]{5}[0-9]{4}[A-Z]{1}[1-9A-Z]{1}Z[0-9A-Z]{1}', para_text):
+            for page in self.ocr_json.get('pages', ()):
+                for block in page.get('blocks', ()):
+                    for paragraph in block.get('paragraphs', ()):
+                        para_text = ''.join(
+                            symbol.get('text', '')
+                            for word in paragraph.get('words', ())
+                            for symbol in word.get('symbols', ())
+                        )
+                        if _GSTIN_RE.search(para_text):
                             # Found a GSTIN. Look for text above or near it
                             # This needs more sophisticated positional logic,
                             # for now, let's just avoid state codes if found.
@@ -104,84 +246,50 @@ class InvoiceFieldParser:
                             pass # Placeholder for future OCR_JSON based positional parsing
 
         # If none of the above, try a general name pattern (less reliable)
-        general_name_patterns = [
-            r"ATTN:\s*([A-Z0-9\s&\.,-]+)",
-            r"M/S\.?\s*([A-Z0-9\s&\.,-]+)"
-        ]
-        buyer_name = self._find_first_match(general_name_patterns)
+        buyer_name = self._find_first_match(_GENERAL_NAME_RE)
         if buyer_name:
-            buyer_name = re.sub(r',?\s*(?:[A-Z][a-z]+,\s*CODE:\s*\d{2})', '', buyer_name).strip()
+            buyer_name = _STATE_CODE_RE.sub('', buyer_name).strip()
             return buyer_name
         
         return None
 
+    @_memo("buyer_gstin")
     def parse_buyer_gstin(self):
-        patterns = [
-            r"BUYER\s*GSTIN\s*[:.]?\s*([0-9]{2}[A-Z]{5}[0-9]{4}[A-Z]{1}[1-9A-Z]{1}Z[0-9A-Z]{1})",
-            r"BILL\s*TO\s*GSTIN\s*[:.]?\s*([0-9]{2}[A-Z]{5}[0-9]{4}[A-Z]{1}[1-9A-Z]{1}Z[0-9A-Z]{1})",
-            r"SHIP\s*TO\s*GSTIN\s*[:.]?\s*([0-9]{2}[A-Z]{5}[0-9]{4}[A-Z]{1}[1-9A-Z]{1}Z[0-9A-Z]{1})",
-            r"GSTIN\s*OF\s*RECIPIENT\s*[:.]?\s*([0-9]{2}[A-Z]{5}[0-9]{4}[A-Z]{1}[1-9A-Z]{1}Z[0-9A-Z]{1})",
-            r"RECIPIENT\s*GSTIN\s*[:.]?\s*([0-9]{2}[A-Z]{5}[0-9]{4}[A-Z]{1}[1-9A-Z]{1}Z[0-9A-Z]{1})",
-            # General GSTIN pattern, excluding the seller's GSTIN if already found
-            r"(?<!SELLER\s*GSTIN\s*[:.]?)\s*([0-9]{2}[A-Z]{5}[0-9]{4}[A-Z]{1}[1-9A-Z]{1}Z[0-9A-Z]{1})"
-        ]
-        gstin_matches = []
-        for line in self.lines:
-            for pattern in patterns:
-                match = re.search(pattern, line)
-                if match:
-                    gstin = match.group(1)
-                    if gstin not in gstin_matches and gstin != self.extracted_fields.get("seller_gstin"):
-                        gstin_matches.append(gstin)
-        return gstin_matches[0] if gstin_matches else None
+        seller_gstin = self.parse_seller_gstin()
+        # The first GSTIN on the invoice that isn't the seller's
+        for match in _GSTIN_RE.finditer(self.ocr_text):
+            gstin = match.group(0).upper()
+            if gstin != seller_gstin:
+                return gstin
+        return None
 
+    @_memo("total_tax_amount")
     def parse_total_tax_amount(self):
-        patterns = [
-            r"(?:TOTAL\s*TAX|TAX\s*AMOUNT|GST\s*AMOUNT)\s*[:.]?\s*(?:RS\.?|INR)?\s*([0-9]+\.[0-9]{2})",
-            r"TAX\s*TOTAL\s*[:.]?\s*(?:RS\.?|INR)?\s*([0-9]+\.[0-9]{2})",
-            r"TOTAL\s*GST\s*[:.]?\s*(?:RS\.?|INR)?\s*([0-9]+\.[0-9]{2})",
-            r"SGST\s*\+\s*CGST\s*[:.]?\s*(?:RS\.?|INR)?\s*([0-9]+\.[0-9]{2})",
-            r"IGST\s*[:.]?\s*(?:RS\.?|INR)?\s*([0-9]+\.[0-9]{2})"
-        ]
-        amount = self._find_first_match(patterns)
+        amount = self._find_first_match(_TOTAL_TAX_RE)
         return float(amount) if amount else None
 
+    @_memo("grand_total")
     def parse_grand_total(self):
-        patterns = [
-            r"(?:GRAND\s*TOTAL|NET\s*AMOUNT|TOTAL\s*AMOUNT|AMOUNT\s*PAYABLE|TOTAL)\s*[:.]?\s*(?:RS\.?|INR)?\s*([0-9]+(?:,[0-9]{3})*\.[0-9]{2})",
-            r"TOTAL\s*VALUE\s*[:.]?\s*(?:RS\.?|INR)?\s*([0-9]+(?:,[0-9]{3})*\.[0-9]{2})",
-            r"AMOUNT\s*IN\s*FIGURES\s*[:.]?\s*(?:RS\.?|INR)?\s*([0-9]+(?:,[0-9]{3})*\.[0-9]{2})",
-            r"BALANCE\s*DUE\s*[:.]?\s*(?:RS\.?|INR)?\s*([0-9]+(?:,[0-9]{3})*\.[0-9]{2})",
-            r"TOTAL\s*(?:RS\.?|INR)?\s*([0-9]+(?:,[0-9]{3})*\.[0-9]{2})"
-        ]
-        
-        # Prioritize patterns with 'RS.' or 'INR' or rupee symbol
-        rupee_symbol_patterns = [
-            r"₹\s*([0-9]+(?:,[0-9]{3})*\.[0-9]{2})",
-            r"(?:RS\.?|INR)\s*([0-9]+(?:,[0-9]{3})*\.[0-9]{2})",
-            r"(?:GRAND\s*TOTAL|NET\s*AMOUNT|TOTAL\s*AMOUNT|AMOUNT\s*PAYABLE|TOTAL)\s*[:.]?\s*₹\s*([0-9]+(?:,[0-9]{3})*\.[0-9]{2})"
-        ]
-        
-        for pattern in rupee_symbol_patterns:
-            for line in self.lines:
-                match = re.search(pattern, line, re.IGNORECASE)
-                if match:
-                    amount_str = match.group(1).replace(',', '')
-                    return float(amount_str)
+        for pattern in _RUPEE_SYMBOL_PATTERNS:
+            match = self._search(pattern)
+            if match:
+                amount_str = match.group(1).replace(',', '')
+                return float(amount_str)
         
         # Fallback to general patterns if rupee symbol/explicit currency not found
-        amount = self._find_first_match(patterns)
+        amount = self._find_first_match(_GRAND_TOTAL_RE)
         return float(amount.replace(',', '')) if amount else None
 
+    @_memo("line_items")
     def parse_line_items(self):
         line_items = []
         if self.ocr_json and self.ocr_json.get('pages') and self.ocr_json['pages'][0].get('tables'):
             logger.info("Attempting to parse line items from ocr_json tables.")
             # Assume the first table on the first page contains line items
             for table in self.ocr_json['pages'][0]['tables']:
-                for row in table.get('rows', []):
+                for row in table.get('rows', ()):
                     item_data = {}
-                    cells = row.get('cells', [])
+                    cells = row.get('cells', ())
                     
                     # Basic assumption: map cell index to field. This needs to be robustified
                     # by mapping column headers to content.
@@ -226,46 +334,33 @@ class InvoiceFieldParser:
         
         logger.info("Falling back to regex-based line item parsing (no ocr_json tables or parsing failed).")
         # Fallback to regex-based parsing if ocr_json tables are not available or parsing from them fails
-        # This regex attempts to capture common line item patterns
-        # Adjust patterns to be more flexible and capture all relevant fields
-        line_item_pattern = re.compile(
-            r"(\d+)\s+" # Item number (group 1)
-            r"(.+?)\s+" # Description (group 2, non-greedy)
-            r"([A-Z0-9]{4,8})?\s*" # HSN/SAC (optional, group 3)
-            r"(\d+\.?\d*)\s+" # Quantity (group 4)
-            r"(\d+\.?\d*)\s+" # Rate (group 5)
-            r"(\d+\.?\d*)\s+" # Taxable Value (group 6)
-            r"(\d+\.?\d*)?" # Tax Percentage (optional, group 7)
-            r"(\d+\.?\d*)" # Total (group 8)
-        )
-
-        for line in self.lines:
-            match = line_item_pattern.search(line)
-            if match:
-                try:
-                    line_items.append({
-                        "description": match.group(2).strip(),
-                        "hsn_sac": match.group(3).strip() if match.group(3) else None,
-                        "quantity": float(match.group(4)),
-                        "rate": float(match.group(5)),
-                        "taxable_value": float(match.group(6)),
-                        "tax_percentage": float(match.group(7)) if match.group(7) else None,
-                        "total": float(match.group(8))
-                    })
-                except Exception as e:
-                    logger.warning(f"Error parsing line item from line '{line}': {e}")
+        for match in _LINE_ITEM_RE.finditer(self.ocr_text):
+            # Unpack all groups at once rather than calling match.group() per field
+            _, description, hsn_sac, quantity, rate, taxable_value, tax_percentage, total = match.groups()
+            try:
+                line_items.append({
+                    "description": description.strip(),
+                    "hsn_sac": hsn_sac.strip() if hsn_sac else None,
+                    "quantity": float(quantity),
+                    "rate": float(rate),
+                    "taxable_value": float(taxable_value),
+                    "tax_percentage": float(tax_percentage) if tax_percentage else None,
+                    "total": float(total)
+                })
+            except Exception as e:
+                logger.warning(f"Error parsing line item from line '{match.group(0)}': {e}")
         
         logger.info(f"Parsed {len(line_items)} line items using regex fallback.")
         return line_items
 
     def _get_cell_text(self, cell):
         """Helper to extract text from a Vision API table cell."""
-        text_segments = []
-        for block in cell.get('blocks', []):
-            for paragraph in block.get('paragraphs', []):
-                for word in paragraph.get('words', []):
-                    text_segments.append(''.join([s.get('text', '') for s in word.get('symbols', [])]))
-        return ' '.join(text_segments).strip()
+        return ' '.join(
+            ''.join(s.get('text', '') for s in word.get('symbols', ()))
+            for block in cell.get('blocks', ())
+            for paragraph in block.get('paragraphs', ())
+            for word in paragraph.get('words', ())
+        ).strip()
 
     def _try_float(self, value_str):
         """Helper to convert string to float, handling potential errors."""
@@ -274,14 +369,36 @@ class InvoiceFieldParser:
         except (ValueError, TypeError):
             return 0.0 # Default to 0.0 or handle as needed
             
-    def _find_first_match(self, patterns, field_name=None):
-        for line in self.lines:
-            for pattern in patterns:
-                match = re.search(pattern, line, re.IGNORECASE)
-                if match:
-                    if field_name:
-                        logger.info(f"Found {field_name}: {match.group(1)}")
-                    return match.group(1).strip()
+    def _scan_all(self):
+        """Map each of _SCANNED_PATTERNS that matches to its leftmost match start."""
+        data = self.ocr_text.encode('utf-8')
+        byte_starts = {}
+
+        def on_match(pattern_id, start, end, flags, context):
+            if start < byte_starts.get(pattern_id, len(data)):
+                byte_starts[pattern_id] = start
+
+        _SCAN_DB.scan(data, match_event_handler=on_match)
+        # Hyperscan reports byte offsets; the compiled patterns need str offsets
+        return {
+            _SCANNED_PATTERNS[pattern_id]: len(data[:start].decode('utf-8'))
+            for pattern_id, start in byte_starts.items()
+        }
+
+    def _search(self, pattern):
+        if _SCAN_DB is None or pattern not in _SCANNED_PATTERNS:
+            return pattern.search(self.ocr_text)
+        if self._match_starts is None:
+            self._match_starts = self._scan_all()
+        start = self._match_starts.get(pattern)
+        return pattern.search(self.ocr_text, start) if start is not None else None
+
+    def _find_first_match(self, pattern, field_name=None):
+        match = self._search(pattern)
+        if match:
+            if field_name:
+                logger.info(f"Found {field_name}: {match.group(1)}")
+            return match.group(1).strip()
         if field_name:
             logger.info(f"Could not find {field_name}.")
         return None
@@ -1,8 +1,8 @@
 import os
-import json
 import logging
+import orjson
 from django.core.management.base import BaseCommand
-from invoices.models import Invoice # This import will work because manage.py sets up the environment
+from invoices.models import InvoiceOCR # This import will work because manage.py sets up the environment
 
 logger = logging.getLogger(__name__)
 
@@ -24,18 +24,18 @@ class Command(BaseCommand):
         os.makedirs(json_dir, exist_ok=True)
 
         try:
-            invoice = Invoice.objects.get(id=invoice_id)
-        except Invoice.DoesNotExist:
-            self.stderr.write(self.style.ERROR(f"Invoice #{invoice_id} not found in the database."))
+            ocr = InvoiceOCR.objects.only('ocr_json').get(invoice_id=invoice_id)
+        except InvoiceOCR.DoesNotExist:
+            self.stderr.write(self.style.ERROR(f"No OCR data for Invoice #{invoice_id} in the database."))
             return
 
-        if not invoice.ocr_json:
+        if not ocr.ocr_json:
             self.stderr.write(self.style.WARNING(f"No OCR JSON data found for Invoice #{invoice_id}."))
             return
 
         # Export the OCR JSON data
         output_file = os.path.join(json_dir, f'invoice_{invoice_id}.json')
-        with open(output_file, 'w') as f:
-            json.dump(invoice.ocr_json, f, indent=2)
+        with open(output_file, 'wb') as f:
+            f.write(orjson.dumps(ocr.ocr_json, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS))
 
         self.stdout.write(self.style.SUCCESS(f"OCR JSON data exported to {output_file}")) 
\ No newline at end of file
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.2 on 2026-10-14 10:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("invoices", "0005_invoice_upload_status_alter_invoice_status"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="invoice",
+            index=models.Index(fields=["-uploaded_at"], name="invoice_uploaded_at_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="invoice",
+            index=models.Index(
+                fields=["user", "-uploaded_at"], name="invoice_user_uploaded_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="invoice",
+            index=models.Index(fields=["status"], name="invoice_status_idx"),
+        ),
+    ]
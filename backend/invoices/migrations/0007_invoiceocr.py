@@ -0,0 +1,70 @@
+# Generated by Django 5.2.2 on 2026-10-14 10:30
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def copy_ocr_to_invoiceocr(apps, schema_editor):
+    Invoice = apps.get_model("invoices", "Invoice")
+    InvoiceOCR = apps.get_model("invoices", "InvoiceOCR")
+    rows = (
+        Invoice.objects.exclude(ocr_data__isnull=True, ocr_json__isnull=True)
+        .values_list("id", "ocr_data", "ocr_json")
+        .iterator()
+    )
+    InvoiceOCR.objects.bulk_create(
+        (
+            InvoiceOCR(
+                invoice_id=invoice_id,
+                ocr_text=(ocr_data or {}).get("text") or "",
+                ocr_json=ocr_json,
+            )
+            for invoice_id, ocr_data, ocr_json in rows
+        ),
+        batch_size=500,
+    )
+
+
+def copy_invoiceocr_to_ocr(apps, schema_editor):
+    Invoice = apps.get_model("invoices", "Invoice")
+    InvoiceOCR = apps.get_model("invoices", "InvoiceOCR")
+    for ocr in InvoiceOCR.objects.iterator():
+        Invoice.objects.filter(id=ocr.invoice_id).update(
+            ocr_data={"text": ocr.ocr_text}, ocr_json=ocr.ocr_json
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("invoices", "0006_invoice_indexes"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="InvoiceOCR",
+            fields=[
+                (
+                    "invoice",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="ocr",
+                        serialize=False,
+                        to="invoices.invoice",
+                    ),
+                ),
+                ("ocr_text", models.TextField(blank=True, default="")),
+                ("ocr_json", models.JSONField(blank=True, null=True)),
+            ],
+        ),
+        migrations.RunPython(copy_ocr_to_invoiceocr, copy_invoiceocr_to_ocr),
+        migrations.RemoveField(
+            model_name="invoice",
+            name="ocr_data",
+        ),
+        migrations.RemoveField(
+            model_name="invoice",
+            name="ocr_json",
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.2 on 2026-10-14 11:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("invoices", "0007_invoiceocr"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="lineitem",
+            name="fingerprint",
+            field=models.CharField(blank=True, db_index=True, default="", max_length=16),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.18 on 2026-10-14 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("invoices", "0008_lineitem_fingerprint"),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name="lineitem",
+            options={"ordering": ["position"]},
+        ),
+        migrations.AddField(
+            model_name="lineitem",
+            name="position",
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
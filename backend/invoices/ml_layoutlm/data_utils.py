@@ -1,4 +1,5 @@
 import json
+import functools
 import cv2 # Assuming you have opencv-python installed as instructed
 import numpy as np # Import numpy
 from transformers import LayoutLMv3Processor
@@ -10,10 +11,51 @@ import torch
 current_dir = os.path.dirname(os.path.abspath(__file__))
 sample_json_path = os.path.join(current_dir, "invoice_69_ocr_json.json")
 
-processor = LayoutLMv3Processor.from_pretrained("microsoft/layoutlmv3-base", apply_ocr=False)
+@functools.lru_cache(maxsize=None)
+def get_processor(model_id="microsoft/layoutlmv3-base"):
+    """Load the processor once per model id, with the fast (Rust) tokenizer."""
+    processor = LayoutLMv3Processor.from_pretrained(model_id, apply_ocr=False, use_fast=True)
+    if not processor.tokenizer.is_fast:
+        print(f"Warning: {model_id} has no fast tokenizer; falling back to the slow Python tokenizer.")
+    return processor
 
-def ocr_json_to_layoutlm_inputs(ocr_json, image_path=None):
+def extract_words_and_boxes(ocr_json, warn=True):
+    """Return the non-blank words of an OCR JSON and their valid 0-1000 boxes."""
     words, boxes = [], []
+    # Modify this loop to match the structure generated by generate_ocr_jsons_from_images.py
+    for page in ocr_json.get("pages", []):
+        # For simplicity, we assume one page and the bbox is already normalized
+        # If the generated JSON is simpler, we directly access words and bboxes
+        for block in page.get("blocks", []):
+            for line in block.get("lines", []):
+                for word_entry in line.get("words", []):
+                    txt = word_entry.get("text", "")
+                    if not txt.strip():
+                        continue
+                    words.append(txt)
+                    boxes.append(word_entry.get("bbox", [0,0,0,0])) # Bbox is already normalized 0-1000
+
+    if boxes:
+        # Ensure coordinates are valid and within [0, 1000], checking all boxes at once.
+        # The bbox from generate_ocr_jsons_from_images.py is already normalized.
+        box_array = np.asarray(boxes)
+        valid = (
+            ((box_array >= 0) & (box_array <= 1000)).all(axis=1)
+            & (box_array[:, 2] >= box_array[:, 0])
+            & (box_array[:, 3] >= box_array[:, 1])
+        )
+        if not valid.all():
+            if warn:
+                for idx in np.flatnonzero(~valid).tolist():
+                    print(f"Warning: Skipping invalid normalized box for word: {words[idx]} - {boxes[idx]}")
+            keep = valid.tolist()
+            words = [word for word, ok in zip(words, keep) if ok]
+            boxes = [box for box, ok in zip(boxes, keep) if ok]
+    return words, boxes
+
+def ocr_json_to_layoutlm_inputs(ocr_json, image_path=None, processor=None):
+    if processor is None:
+        processor = get_processor()
     image = None
 
     if image_path and os.path.exists(image_path):
@@ -30,29 +72,7 @@ def ocr_json_to_layoutlm_inputs(ocr_json, image_path=None):
         image = np.ones((1000, 1000, 3), dtype=np.uint8) * 255
         print("Using a dummy blank image as input to LayoutLMv3Processor.")
 
-    # Modify this loop to match the structure generated by generate_ocr_jsons_from_images.py
-    for page in ocr_json.get("pages", []):
-        # For simplicity, we assume one page and the bbox is already normalized
-        # If the generated JSON is simpler, we directly access words and bboxes
-        for block in page.get("blocks", []):
-            for line in block.get("lines", []):
-                for word_entry in line.get("words", []):
-                    txt = word_entry.get("text", "")
-                    bbox = word_entry.get("bbox", [0,0,0,0]) # Bbox is already normalized 0-1000
-
-                    if not txt.strip():
-                        continue
-
-                    # Ensure coordinates are valid and within [0, 1000]
-                    # The bbox from generate_ocr_jsons_from_images.py is already normalized.
-                    # We just need to ensure it's a valid box before appending.
-                    x0, y0, x1, y1 = bbox
-                    if not (0 <= x0 <= 1000 and 0 <= y0 <= 1000 and 0 <= x1 <= 1000 and 0 <= y1 <= 1000 and x1 >= x0 and y1 >= y0):
-                        print(f"Warning: Skipping invalid normalized box for word: {txt} - {bbox}")
-                        continue
-
-                    boxes.append(bbox)
-                    words.append(txt)
+    words, boxes = extract_words_and_boxes(ocr_json)
 
     if not words or not boxes:
         print("Warning: No valid words or boxes extracted from OCR JSON. Returning empty encoding.")
@@ -111,14 +131,14 @@ if __name__ == "__main__":
             token_id = enc["input_ids"][0, i].item()
             bbox = enc["bbox"][0, i].tolist()
             # Convert token ID back to string (approximate, for visualization)
-            word = processor.tokenizer.decode([token_id])
+            word = get_processor().tokenizer.decode([token_id])
             print(f"  Token: '{word}', Box: {bbox}")
 
         print("\nLast 5 tokens and their boxes:")
         for i in range(max(0, enc["input_ids"].shape[1] - 5), enc["input_ids"].shape[1]):
             token_id = enc["input_ids"][0, i].item()
             bbox = enc["bbox"][0, i].tolist()
-            word = processor.tokenizer.decode([token_id])
+            word = get_processor().tokenizer.decode([token_id])
             print(f"  Token: '{word}', Box: {bbox}")
     else:
         print("Failed to generate LayoutLM inputs.") 
\ No newline at end of file
@@ -1,134 +1,366 @@
 import os
 import json
+import random
+import functools
+import numpy as np
 import torch
-from torch.utils.data import Dataset
-from data_utils import ocr_json_to_layoutlm_inputs
+import cv2
+from torch.utils.data import DataLoader, Dataset, get_worker_info
+from data_utils import extract_words_and_boxes, get_processor, ocr_json_to_layoutlm_inputs
+
+try:
+    # orjson parses straight from bytes and is several times faster than json
+    # on the large OCR files read in __getitem__.
+    import orjson
+except ImportError:
+    orjson = None
+
+def _load_json(path):
+    with open(path, 'rb') as f:
+        data = f.read()
+    return orjson.loads(data) if orjson is not None else json.loads(data)
+
+# JSON files in the data directory that are not OCR output
+_MANIFEST_FILE = "training_manifest.json"
+_LABELS_FILE = "labels.json"
+
+@functools.lru_cache(maxsize=None)
+def load_manifest(json_dir):
+    """Parse json_dir's training manifest once per process. The result is shared, so don't modify it."""
+    return _load_json(os.path.join(json_dir, _MANIFEST_FILE))
+
+def load_labels(json_dir):
+    """
+    Return the label sets of json_dir's training manifest:
+    {"classes": sorted region classes, "label2id": token label -> id, with "O" as 0}.
+    They are cached in labels.json next to the manifest and only recomputed
+    (and the cache rewritten) when the manifest is newer.
+    """
+    labels_path = os.path.join(json_dir, _LABELS_FILE)
+    try:
+        if os.path.getmtime(labels_path) >= os.path.getmtime(os.path.join(json_dir, _MANIFEST_FILE)):
+            return _load_json(labels_path)
+    except OSError:
+        pass
+
+    manifest = load_manifest(json_dir)
+    classes = set()
+    labels_seen = set()
+    for item in manifest:
+        classes.update(region["class"] for region in item["regions"])
+        labels_seen.update(token["label"] for token in item["tokens"])
+    label2id = {"O": 0}
+    for current_id, label in enumerate(sorted(labels_seen - {"O"}), start=1):
+        label2id[label] = current_id
+    labels = {"classes": sorted(classes), "label2id": label2id}
+
+    try:
+        with open(labels_path, 'w', encoding='utf-8') as f:
+            json.dump(labels, f)
+    except OSError as e:
+        print(f"Warning: could not write {labels_path}: {e}")
+    return labels
+
+# Common image extensions, in order of preference when several share a name
+_IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.pdf')
+
+def _index_images(image_dir):
+    """Map each image's base name in image_dir to its path, in one directory scan."""
+    # Assuming image file name matches JSON file name (e.g., invoice_69.json -> invoice_69.jpg)
+    # You might need to adjust this logic based on your actual file naming convention
+    found = {}
+    with os.scandir(image_dir) as entries:
+        for entry in entries:
+            base_name, ext = os.path.splitext(entry.name)
+            if ext in _IMAGE_EXTENSIONS and entry.is_file():
+                rank = _IMAGE_EXTENSIONS.index(ext)
+                if base_name not in found or rank < found[base_name][0]:
+                    found[base_name] = (rank, entry.path)
+    return {base_name: path for base_name, (rank, path) in found.items()}
+
+def _image_paths_for(image_dir, file_names):
+    """Resolve the image for each JSON file name (None when there is none)."""
+    if not image_dir:
+        return [None] * len(file_names)
+    image_index = _index_images(image_dir)
+    return [image_index.get(os.path.splitext(os.path.basename(name))[0]) for name in file_names]
 
 class LayoutLMv3Dataset(Dataset):
     def __init__(self, json_dir, image_dir=None, processor=None):
         self.json_dir = json_dir
         self.image_dir = image_dir
         self.processor = processor
-        # Only include actual OCR JSON files, not the manifest
-        self.data_files = [f for f in os.listdir(json_dir) if f.endswith('.json') and f != 'training_manifest.json']
-        
+        # Only include actual OCR JSON files, not the manifest or the label cache.
+        # Entries keep their full path so __getitem__ does not have to join it again.
+        with os.scandir(json_dir) as entries:
+            self.data_files = [
+                entry.path for entry in entries
+                if entry.is_file() and entry.name.endswith('.json') and entry.name not in (_MANIFEST_FILE, _LABELS_FILE)
+            ]
+        # Drop files that would produce an empty encoding (no non-blank word with
+        # a valid box) so they never take up a batch slot
+        kept_files = []
+        for path in self.data_files:
+            if extract_words_and_boxes(_load_json(path), warn=False)[0]:
+                kept_files.append(path)
+            else:
+                print(f"Warning: Skipping {os.path.basename(path)} due to empty or invalid OCR data.")
+        self.data_files = kept_files
+        self.image_paths = _image_paths_for(image_dir, self.data_files)
+
         # Load training manifest
-        manifest_path = os.path.join(json_dir, "training_manifest.json")
-        with open(manifest_path, 'r', encoding='utf-8') as f:
-            self.training_manifest = json.load(f)
+        self.training_manifest = load_manifest(json_dir)
             
         # Create a mapping of file names to their annotations
         self.annotations = {}
-        all_unique_classes = set([item["label"] for manifest_entry in self.training_manifest for item in manifest_entry["tokens"]])
-        
-        # Create label2id mapping, ensuring 'O' (Outside) is always mapped to 0
-        self.label2id = {"O": 0}
-        current_id = 1
-        for label in sorted(all_unique_classes):
-            if label != "O":
-                self.label2id[label] = current_id
-                current_id += 1
-                
-        self.id2label = {idx: label for label, idx in self.label2id.items()}
-
         for item in self.training_manifest:
             file_name = os.path.basename(item.get("file_name", ""))
             if file_name:
                 self.annotations[file_name] = item["tokens"] # Store tokens directly
 
+        # label2id mapping, with 'O' (Outside) always mapped to 0
+        self.label2id = load_labels(json_dir)["label2id"]
+
+        self.id2label = {idx: label for label, idx in self.label2id.items()}
+
+        # Samples are immutable, so each one is built once and reused on later
+        # epochs, up to LAYOUTLM_CACHE_MB of tensors (0 disables the cache).
+        # With DataLoader workers every worker keeps its own cache, which only
+        # survives between epochs when persistent_workers=True.
+        self._cache = {}
+        self._cache_bytes = 0
+        self._cache_limit = int(os.environ.get("LAYOUTLM_CACHE_MB", "512")) * 1024 * 1024
+
     def __len__(self):
         return len(self.data_files)
 
     def __getitem__(self, idx):
-        file_name = self.data_files[idx]
-        json_path = os.path.join(self.json_dir, file_name)
-
-        with open(json_path, 'r', encoding='utf-8') as f:
-            ocr_json = json.load(f)
-
-        image_path = None
-        if self.image_dir:
-            # Assuming image file name matches JSON file name (e.g., invoice_69.json -> invoice_69.jpg)
-            # You might need to adjust this logic based on your actual file naming convention
-            base_name = os.path.splitext(file_name)[0]
-            # Attempt common image extensions
-            for ext in ['.jpg', '.jpeg', '.png', '.pdf']:
-                potential_image_path = os.path.join(self.image_dir, base_name + ext)
-                if os.path.exists(potential_image_path):
-                    image_path = potential_image_path
-                    break
-            if not image_path:
-                print(f"Warning: No image found for {file_name} in {self.image_dir}. Processing text-only.")
+        if idx in self._cache:
+            return self._cache[idx]
+
+        sample = self._load_item(idx)
+        size = sum(t.numel() * t.element_size() for t in sample.values() if t is not None)
+        if self._cache_bytes + size <= self._cache_limit:
+            self._cache[idx] = sample
+            self._cache_bytes += size
+        return sample
+
+    def _load_item(self, idx):
+        json_path = self.data_files[idx]
+        file_name = os.path.basename(json_path)
+
+        ocr_json = _load_json(json_path)
+
+        image_path = self.image_paths[idx]
+        if self.image_dir and not image_path:
+            print(f"Warning: No image found for {file_name} in {self.image_dir}. Processing text-only.")
 
         # Get the encoding from OCR JSON
-        encoding = ocr_json_to_layoutlm_inputs(ocr_json, image_path)
-
-        # Ensure that if encoding is empty, we handle it gracefully
-        if encoding is None or encoding["input_ids"].numel() == 0:
-            print(f"Warning: Skipping {file_name} due to empty or invalid OCR data.")
-            # If the input_ids is empty, the label should also be empty.
-            return {
-                "input_ids": torch.tensor([]).long(),
-                "attention_mask": torch.tensor([]).long(),
-                "bbox": torch.tensor([[]]).long(),
-                "pixel_values": torch.tensor([[[[]]]]).float(),
-                "labels": torch.tensor([]).long()
-            }
+        encoding = ocr_json_to_layoutlm_inputs(ocr_json, image_path, processor=self.processor)
 
         # Get annotations for this file (now containing BIO tokens)
         file_annotations_tokens = self.annotations.get(file_name, [])
         
-        # Initialize labels for all tokens in the sequence to 'O' (Outside)
-        labels = torch.full((encoding["input_ids"].shape[1],), self.label2id["O"], dtype=torch.long)
-
         # Get word_ids for aligning tokens to original words
         word_ids = encoding["word_ids"].squeeze(0).tolist() # Access directly
 
-        previous_word_idx = None
-        current_word_annotation = None
+        # Index annotations by (text, box) so each word is matched with one dict
+        # lookup. setdefault keeps the first annotation for duplicate keys, as
+        # the linear scan did.
+        ann_by_key = {}
+        for ann_token in file_annotations_tokens:
+            ann_by_key.setdefault((ann_token["text"], tuple(ann_token["box"])), ann_token)
+        encoding_words = encoding.words
+        encoding_boxes = encoding.boxes
 
-        # Iterate through the model's tokens and assign labels based on BIO annotations
-        for token_idx, word_idx in enumerate(word_ids):
-            if word_idx is None: # Special tokens like [CLS], [SEP]
-                labels[token_idx] = self.label2id["O"]
-                continue
-            
-            if word_idx != previous_word_idx:
-                # New word, find its annotation
-                current_word_annotation = None
-                for ann_token in file_annotations_tokens:
-                    # Try to match by text and box for robustness
-                    # This is a simplified match, a more robust solution might need character offsets or fuzzy matching
-                    if ann_token["text"] == encoding.words[word_idx] and ann_token["box"] == encoding.boxes[word_idx]:
-                        current_word_annotation = ann_token
-                        break
-            
-            if current_word_annotation:
-                label_tag = current_word_annotation["label"]
-                labels[token_idx] = self.label2id.get(label_tag, self.label2id["O"])
-            
-            previous_word_idx = word_idx
+        # Resolve one label id per word, then spread it over the word's tokens.
+        # Special tokens like [CLS], [SEP] have no word (-1) and stay 'O' (Outside).
+        outside_id = self.label2id["O"]
+        word_ids_arr = np.array([-1 if word_idx is None else word_idx for word_idx in word_ids], dtype=np.int64)
+        num_words = int(word_ids_arr.max()) + 1 if word_ids_arr.size else 0
+        word_to_label_id = np.full(max(num_words, 1), outside_id, dtype=np.int64)
+        for word_idx in np.unique(word_ids_arr[word_ids_arr >= 0]).tolist():
+            # Match by text and box for robustness
+            # This is a simplified match, a more robust solution might need character offsets or fuzzy matching
+            ann_token = ann_by_key.get((encoding_words[word_idx], tuple(encoding_boxes[word_idx])))
+            if ann_token:
+                word_to_label_id[word_idx] = self.label2id.get(ann_token["label"], outside_id)
+        labels_np = np.where(word_ids_arr == -1, outside_id, word_to_label_id[word_ids_arr.clip(min=0)])
 
-        # Prepare the output
+        # Prepare the output. Samples are kept in the narrowest dtype that holds
+        # them (token ids < 2**31, boxes 0-1000, small label ids), which shrinks
+        # the cache and the worker-to-trainer copies; collate_fn below widens
+        # them back to int64 when it builds the batch.
         return {
-            "input_ids": encoding["input_ids"].squeeze(0),
-            "attention_mask": encoding["attention_mask"].squeeze(0),
-            "bbox": encoding["bbox"].squeeze(0),
+            "input_ids": encoding["input_ids"].squeeze(0).to(torch.int32),
+            "attention_mask": encoding["attention_mask"].squeeze(0).to(torch.bool),
+            "bbox": encoding["bbox"].squeeze(0).to(torch.int16),
             "pixel_values": encoding["pixel_values"].squeeze(0) if "pixel_values" in encoding else None,
-            "labels": labels
+            "labels": torch.from_numpy(labels_np.astype(np.int16))
         }
 
+_FEATURE_COLUMNS = ("input_ids", "attention_mask", "bbox", "labels")
+# The dtype each column is served in, matching LayoutLMv3Dataset's samples
+_FEATURE_DTYPES = {
+    "input_ids": np.int32,
+    "attention_mask": np.bool_,
+    "bbox": np.int16,
+    "labels": np.int16,
+}
+
+def precompute_features(json_dir, out_path, image_dir=None, processor=None):
+    """
+    Run OCR JSON loading, tokenization and label alignment once for every file
+    and write the token features to a Parquet file for PrecomputedLayoutLMv3Dataset.
+    Pixel values are not stored; images stay on disk and are loaded per sample.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    dataset = LayoutLMv3Dataset(json_dir=json_dir, image_dir=image_dir, processor=processor)
+    rows = {"file_name": [], **{column: [] for column in _FEATURE_COLUMNS}}
+    for idx in range(len(dataset)):
+        sample = dataset._load_item(idx)
+        rows["file_name"].append(os.path.basename(dataset.data_files[idx]))
+        for column in _FEATURE_COLUMNS:
+            rows[column].append(sample[column].numpy())
+
+    # input_ids need 32 bits (the vocabulary is ~50k); boxes are 0-1000 and
+    # label ids are small, so both fit in int16.
+    table = pa.table({
+        "file_name": pa.array(rows["file_name"], pa.string()),
+        "input_ids": pa.array(rows["input_ids"], pa.list_(pa.int32())),
+        "attention_mask": pa.array(rows["attention_mask"], pa.list_(pa.int8())),
+        "bbox": pa.array([box.reshape(-1) for box in rows["bbox"]], pa.list_(pa.int16())),
+        "labels": pa.array(rows["labels"], pa.list_(pa.int16())),
+    }).replace_schema_metadata({"label2id": json.dumps(dataset.label2id)})
+    pq.write_table(table, out_path, compression="zstd")
+    print(f"Wrote {table.num_rows} precomputed samples to {out_path}")
+
+class PrecomputedLayoutLMv3Dataset(Dataset):
+    """
+    Serves the features written by precompute_features from a memory-mapped
+    Parquet file, so training does no JSON parsing or tokenization.
+    """
+    def __init__(self, features_path, image_dir=None, processor=None):
+        import pyarrow.parquet as pq
+
+        self.features_path = features_path
+        self.image_dir = image_dir
+        self.processor = processor
+        self.file_names = pq.read_table(features_path, columns=["file_name"]).column("file_name").to_pylist()
+        self.image_paths = _image_paths_for(image_dir, self.file_names)
+        self.label2id = json.loads(pq.read_schema(features_path).metadata[b"label2id"])
+        self.id2label = {idx: label for label, idx in self.label2id.items()}
+        self._table = None
+
+    @property
+    def table(self):
+        # Mapped lazily so each DataLoader worker maps the file itself rather
+        # than receiving a pickled copy of the table
+        if self._table is None:
+            import pyarrow.parquet as pq
+            self._table = pq.read_table(self.features_path, memory_map=True)
+        return self._table
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_table"] = None
+        return state
+
+    def __len__(self):
+        return len(self.file_names)
+
+    def _column(self, column, idx):
+        # astype copies out of the read-only memory-mapped buffer
+        return torch.from_numpy(self.table.column(column)[idx].values.to_numpy().astype(_FEATURE_DTYPES[column]))
+
+    def __getitem__(self, idx):
+        sample = {column: self._column(column, idx) for column in _FEATURE_COLUMNS}
+        sample["bbox"] = sample["bbox"].view(-1, 4)
+
+        pixel_values = None
+        if self.processor is not None:
+            image_path = self.image_paths[idx]
+            image = cv2.imread(image_path) if image_path else None
+            if image is None:
+                # Same blank page ocr_json_to_layoutlm_inputs uses when there is no image
+                image = np.ones((1000, 1000, 3), dtype=np.uint8) * 255
+            pixel_values = self.processor.image_processor(image, return_tensors="pt")["pixel_values"].squeeze(0)
+        sample["pixel_values"] = pixel_values
+        return sample
+
+# Define a data collator that handles labels
+def collate_fn(batch):
+    # Filter out empty samples that might result from processing errors
+    batch = [item for item in batch if item["input_ids"].numel() > 0]
+    
+    if not batch:
+        return None
+
+    # Every sample is already padded to max_length by the processor, so the
+    # batch is copied straight into one contiguous buffer per key instead of
+    # being re-padded through processor.tokenizer.pad. The dataset stores token
+    # tensors in narrow dtypes; the copy widens them to the int64 the model
+    # expects. This runs in DataLoader workers, so it must not touch CUDA;
+    # pinning is left to the loader, which does it in the main process.
+    dtypes = {"input_ids": torch.long, "attention_mask": torch.long, "bbox": torch.long, "labels": torch.long}
+    if batch[0]["pixel_values"] is not None:
+        dtypes["pixel_values"] = batch[0]["pixel_values"].dtype
+
+    padded_inputs = {}
+    for key, dtype in dtypes.items():
+        tensors = [item[key] for item in batch]
+        out = torch.empty((len(tensors), *tensors[0].shape), dtype=dtype)
+        for row, tensor in zip(out, tensors):
+            row.copy_(tensor)
+        padded_inputs[key] = out
+    padded_inputs.setdefault("pixel_values", None)
+
+    return padded_inputs
+
+def worker_init_fn(worker_id):
+    """Seed each DataLoader worker and map its precomputed features up front."""
+    seed = torch.initial_seed() % 2**32
+    np.random.seed(seed)
+    random.seed(seed)
+    dataset = get_worker_info().dataset
+    if isinstance(dataset, PrecomputedLayoutLMv3Dataset):
+        dataset.table  # maps the Parquet file in this worker
+
+def make_loader(json_dir, image_dir=None, processor=None, batch_size=4, num_workers=4, features_path=None, shuffle=True):
+    """
+    Build a DataLoader over the precomputed features (when features_path is
+    given) or the raw OCR JSONs. Workers are kept alive between epochs, so the
+    dataset is only set up once per worker and LayoutLMv3Dataset's sample cache
+    is reused. Batches are pinned by the loader when training on GPU.
+    """
+    if features_path:
+        dataset = PrecomputedLayoutLMv3Dataset(features_path, image_dir=image_dir, processor=processor)
+    else:
+        dataset = LayoutLMv3Dataset(json_dir=json_dir, image_dir=image_dir, processor=processor)
+    worker_options = {}
+    if num_workers > 0:
+        worker_options = {"persistent_workers": True, "prefetch_factor": 4, "worker_init_fn": worker_init_fn}
+    return DataLoader(
+        dataset,
+        batch_size=batch_size,
+        shuffle=shuffle,
+        num_workers=num_workers,
+        collate_fn=collate_fn,
+        pin_memory=torch.cuda.is_available(),
+        **worker_options,
+    )
+
 # Example usage (for testing):
 if __name__ == "__main__":
-    from transformers import LayoutLMv3Processor
-    
     # Assuming your current working directory is 'backend'
     json_dir = "invoices/ml_layoutlm"
     # For this example, if you have invoice images in media/invoices/
     image_dir = "media/invoices"
 
     # Initialize the processor (same as in data_utils)
-    processor = LayoutLMv3Processor.from_pretrained("microsoft/layoutlmv3-base", apply_ocr=False)
+    processor = get_processor()
 
     dataset = LayoutLMv3Dataset(json_dir=json_dir, image_dir=image_dir, processor=processor)
 
@@ -1,16 +1,121 @@
 import os
-import requests
-from bs4 import BeautifulSoup
+import asyncio
+import aiohttp
 from PIL import Image
-from io import BytesIO
-import time
 import random
+import tempfile
 import urllib.parse
 
-def download_invoice_templates(num_templates=5, output_dir="Invoice Templates"):
+try:
+    # selectolax's lexbor backend parses HTML in C and is much faster than
+    # BeautifulSoup's pure-Python html.parser on large listing pages.
+    from selectolax.lexbor import LexborHTMLParser as HTMLParser
+except ImportError:
+    HTMLParser = None
+    from bs4 import BeautifulSoup
+
+# At most this many image downloads are in flight at once
+MAX_CONCURRENT_DOWNLOADS = 4
+
+# Images are saved as served, so only formats the OCR step can read are kept
+IMAGE_EXTENSIONS = {
+    'image/png': '.png',
+    'image/jpeg': '.jpg',
+    'image/webp': '.webp',
+}
+
+def _verify_image(path):
+    # verify() checks the file's integrity without decoding the pixel data
+    with Image.open(path) as img:
+        img.verify()
+
+def _find_image_urls(website, html):
+    # Find image elements (adjust selectors based on website)
+    if 'pexels.com' in website:
+        selector = 'img[src*="images.pexels.com"]'
+    elif 'pixabay.com' in website:
+        selector = 'img[src*="cdn.pixabay.com"]'
+    elif 'unsplash.com' in website:
+        selector = 'img[src*="images.unsplash.com"]'
+    else:
+        selector = 'img'
+
+    if HTMLParser is not None:
+        srcs = [node.attributes.get('src') for node in HTMLParser(html).css(selector)]
+    else:
+        srcs = [img.get('src') for img in BeautifulSoup(html, 'html.parser').select(selector)]
+
+    img_urls = []
+    for img_url in srcs:
+        # Get image URL
+        if not img_url:
+            continue
+
+        # Make sure URL is absolute
+        if not img_url.startswith(('http://', 'https://')):
+            img_url = urllib.parse.urljoin(website, img_url)
+        img_urls.append(img_url)
+    return img_urls
+
+async def _search_website(session, website):
+    try:
+        print(f"\nSearching on {website}...")
+        async with session.get(website) as response:
+            if response.status != 200:
+                print(f"Failed to access {website}: HTTP {response.status}")
+                return []
+            html = await response.text()
+        return _find_image_urls(website, html)
+    except Exception as e:
+        print(f"Error accessing {website}: {str(e)}")
+        return []
+
+async def _download_image(session, img_url, semaphore, state, num_templates, output_dir):
+    async with semaphore:
+        if state["downloaded"] >= num_templates:
+            return
+        part_path = None
+        try:
+            # Stream the image straight to a temporary file in output_dir
+            async with session.get(img_url) as img_response:
+                if img_response.status != 200:
+                    print(f"Failed to download image: HTTP {img_response.status}")
+                    return
+                ext = IMAGE_EXTENSIONS.get(img_response.content_type)
+                if ext is None:
+                    print(f"Skipping {img_url}: unsupported Content-Type {img_response.content_type}")
+                    return
+                with tempfile.NamedTemporaryFile(dir=output_dir, suffix='.part', delete=False) as f:
+                    part_path = f.name
+                    async for chunk in img_response.content.iter_chunked(64 * 1024):
+                        f.write(chunk)
+
+            # Check with PIL that it is a valid image, off the event loop
+            await asyncio.to_thread(_verify_image, part_path)
+            if state["downloaded"] >= num_templates:
+                return
+            state["downloaded"] += 1
+            template_number = state["downloaded"]
+
+            # Save image
+            output_path = os.path.join(output_dir, f'invoice_template_{template_number}{ext}')
+            os.replace(part_path, output_path)
+            part_path = None
+            print(f"Downloaded template {template_number}: {output_path}")
+
+            # Add a small delay to avoid overwhelming the server
+            await asyncio.sleep(random.uniform(0.1, 0.3))
+        except Exception as e:
+            print(f"Error processing image: {str(e)}")
+        finally:
+            if part_path is not None and os.path.exists(part_path):
+                os.remove(part_path)
+
+async def download_invoice_templates_async(num_templates=5, output_dir="Invoice Templates"):
     """
-    Download sample invoice templates from free stock photo websites.
-    
+    Download sample invoice templates from free stock photo websites,
+    fetching the search pages and then the images concurrently.
+
     Args:
         num_templates (int): Number of templates to download
         output_dir (str): Directory to save the templates
@@ -31,71 +136,32 @@ def download_invoice_templates(num_templates=5, output_dir="Invoice Templates"):
         'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
     }
 
-    downloaded_count = 0
-    for website in websites:
-        if downloaded_count >= num_templates:
-            break
+    state = {"downloaded": 0}
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_DOWNLOADS)
+    timeout = aiohttp.ClientTimeout(total=10)
+    # One pooled session for every request: connections (and their TLS
+    # handshakes) are kept alive and reused per host, and DNS answers are cached
+    connector = aiohttp.TCPConnector(limit_per_host=MAX_CONCURRENT_DOWNLOADS, ttl_dns_cache=300)
+    async with aiohttp.ClientSession(headers=headers, timeout=timeout, connector=connector) as session:
+        url_lists = await asyncio.gather(*[_search_website(session, website) for website in websites])
+        # Keep the website order: earlier sites' images are tried first
+        img_urls = [img_url for urls in url_lists for img_url in urls]
+        await asyncio.gather(*[
+            _download_image(session, img_url, semaphore, state, num_templates, output_dir)
+            for img_url in img_urls
+        ])
 
-        try:
-            print(f"\nSearching on {website}...")
-            response = requests.get(website, headers=headers, timeout=10)
-            if response.status_code != 200:
-                print(f"Failed to access {website}: HTTP {response.status_code}")
-                continue
-
-            soup = BeautifulSoup(response.text, 'html.parser')
-            
-            # Find image elements (adjust selectors based on website)
-            if 'pexels.com' in website:
-                img_elements = soup.select('img[src*="images.pexels.com"]')
-            elif 'pixabay.com' in website:
-                img_elements = soup.select('img[src*="cdn.pixabay.com"]')
-            elif 'unsplash.com' in website:
-                img_elements = soup.select('img[src*="images.unsplash.com"]')
-            else:
-                img_elements = soup.select('img')
-
-            for img in img_elements:
-                if downloaded_count >= num_templates:
-                    break
-
-                try:
-                    # Get image URL
-                    img_url = img.get('src')
-                    if not img_url:
-                        continue
-
-                    # Make sure URL is absolute
-                    if not img_url.startswith(('http://', 'https://')):
-                        img_url = urllib.parse.urljoin(website, img_url)
-
-                    # Download image
-                    img_response = requests.get(img_url, headers=headers, timeout=10)
-                    if img_response.status_code == 200:
-                        # Open image with PIL to verify it's valid
-                        img = Image.open(BytesIO(img_response.content))
-                        
-                        # Save image
-                        output_path = os.path.join(output_dir, f'invoice_template_{downloaded_count + 1}.png')
-                        img.save(output_path, 'PNG')
-                        print(f"Downloaded template {downloaded_count + 1}: {output_path}")
-                        
-                        downloaded_count += 1
-                        
-                        # Add a small delay to avoid overwhelming the server
-                        time.sleep(random.uniform(1, 2))
-                    else:
-                        print(f"Failed to download image: HTTP {img_response.status_code}")
-
-                except Exception as e:
-                    print(f"Error processing image: {str(e)}")
-                    continue
-
-        except Exception as e:
-            print(f"Error accessing {website}: {str(e)}")
-            continue
+    print(f"\nDownloaded {state['downloaded']} invoice templates to {output_dir}")
 
-    print(f"\nDownloaded {downloaded_count} invoice templates to {output_dir}")
+def download_invoice_templates(num_templates=5, output_dir="Invoice Templates"):
+    """
+    Download sample invoice templates from free stock photo websites.
+    
+    Args:
+        num_templates (int): Number of templates to download
+        output_dir (str): Directory to save the templates
+    """
+    asyncio.run(download_invoice_templates_async(num_templates, output_dir))
 
 if __name__ == "__main__":
     # You can modify these parameters
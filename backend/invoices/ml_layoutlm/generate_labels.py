@@ -1,9 +1,27 @@
 import json
 import os
 import re
-import math
+from bisect import bisect_left, bisect_right
 from typing import Dict, List, Tuple, Optional
 import logging
+from concurrent.futures import ProcessPoolExecutor
+import ahocorasick
+import numpy as np
+from scipy.spatial import cKDTree
+
+try:
+    # pyre2 wraps Google's RE2: linear-time matching with no backtracking for the
+    # fallback region patterns, which run over the whole OCR text.
+    import re2
+except ImportError:
+    re2 = None
+
+try:
+    # orjson parses straight from bytes and is several times faster than json
+    # on the OCR files loaded for every invoice.
+    import orjson
+except ImportError:
+    orjson = None
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -21,63 +39,133 @@ REGION_CLASSES = [
     "GRAND_TOTAL"
 ]
 
+def _compile_fallback_pattern(pattern):
+    """Compile with RE2 where it supports the syntax, and with re otherwise."""
+    if re2 is not None:
+        try:
+            return re2.compile(pattern)
+        except Exception: # RE2 rejects e.g. lookarounds and backreferences
+            pass
+    return re.compile(pattern)
+
+# Header words that tell which party a GSTIN belongs to
+_BUYER_RE = re.compile(r'(?i)Buyer|Bill\\s*to')
+_CONSIGNEE_RE = re.compile(r'(?i)Consignee|Ship\\s*to')
+_SELLER_RE = re.compile(r'(?i)Surabhi\\s*Hardwares|Seller|Our\\s*GSTIN')
+
+# Used to widen a header-to-GSTIN span to the party name and address
+_SELLER_NAME_RE = re.compile(r'(?i)([^\\n]+(?:Hardwares|Traders|Enterprises|Pvt\\.?\\s*Ltd\\.?)[^\\n]*)(?:\\s*\\n{1,2}(?:[^\\n]*\\n){0,3}GSTIN)')
+_BILL_TO_NAME_RE = re.compile(r'(?i)(Buyer\\s*\\(\\s*Bill\\s*to\\s*\\)(?:\\s*|\\n*):?(?:\\s*|\\n*)(.*?))(?:\\s*|\\n*)GSTIN')
+_SHIP_TO_NAME_RE = re.compile(r'(?i)(Consignee\\s*\\(\\s*Ship\\s*to\\s*\\)(?:\\s*|\\n*):?(?:\\s*|\\n*)(.*?))(?:\\s*|\\n*)GSTIN')
+
+# Column headings of the line item table, compared against whole words. "No" of
+# "SI No." is left out as it also follows every "Invoice" label above the table.
+_TABLE_HEADER_WORDS = frozenset({
+    'si', 'description', 'hsn', 'sac', 'quantity', 'rate', 'amount', 'cgst', 'sgst', 'total'
+})
+
+# Markers for the start of the summary section, i.e. the end of the line item table.
+# One alternation, so a single search finds the earliest marker of any kind.
+_SUMMARY_END_RE = re.compile(
+    r'(?i)Total\\s*Taxable\\s*Value'
+    r'|Total\\s*Tax\\s*Amount'
+    r'|Amount\\s*Chargeable\\s*\\(\\s*in\\s*words\\s*\\)'
+    r'|Grand\\s*Total'
+    r'|Declaration'
+    r'|E\\.\\s*&\\s*O\\.\\s*E' # Added another common end marker
+)
+
 class LabelGenerator:
     def __init__(self, json_dir: str):
         self.json_dir = json_dir
-        # Define regex patterns for full regions (fallback)
+        # Define regex patterns for full regions (fallback). Patterns that need trailing
+        # context consume it instead of using a lookahead, so RE2 can run them, and
+        # capture the region itself in the 'region' group.
         self.patterns = {
             'SELLER_INFO': r'(?i)([^\\n]+(?:Hardwares|Traders|Enterprises|Pvt\\.?\\s*Ltd\\.?)[^\\n]*)\\s*\\n{1,2}(?:[^\\n]*\\n){0,3}GSTIN\\s*/\\s*UIN\\s*:\\s*([A-Z0-9]{15})',
             'BILL_TO': r'(?i)Buyer\\s*\\(\\s*Bill\\s*to\\s*\\)(?:\\s*|\\n*):?(?:\\s*|\\n*)(.*?)(?:\\s*|\\n*)GSTIN\\s*/\\s*UIN\\s*:\\s*([A-Z0-9]{15})(?:\\s*|\\n*)?',
             'SHIP_TO': r'(?i)Consignee\\s*\\(\\s*Ship\\s*to\\s*\\)(?:\\s*|\\n*):?(?:\\s*|\\n*)(.*?)(?:\\s*|\\n*)GSTIN\\s*/\\s*UIN\\s*:\\s*([A-Z0-9]{15})(?:\\s*|\\n*)?',
-            'INVOICE_NO': r'(?i)(?:Invoice\\s*No\\.?|Invoice\\s*#|Inv\\.?\\s*No\\.?|Bill\\s*No\\.?)\\s*([A-Z0-9/.-]{5,20})(?=\\s*(?:Delivery|Reference|Dated|Buyer|Consignee|\\n{2,}|$))', # More constrained and flexible invoice number
+            'INVOICE_NO': r'(?i)(?P<region>(?:Invoice\\s*No\\.?|Invoice\\s*#|Inv\\.?\\s*No\\.?|Bill\\s*No\\.?)\\s*([A-Z0-9/.-]{5,20}))\\s*(?:Delivery|Reference|Dated|Buyer|Consignee|\\n{2,}|$)', # More constrained and flexible invoice number
             'INVOICE_DATE': r'(?i)Dated(?:\\s|\\n)+(\\d{1,2}\\s*-\\s*[A-Za-z]+\\s*-\\s*\\d{2})',
             'TOTAL_TAX': r'(?i)Total(?:\\s|\\n)+Tax\\s*Amount(?:\\s|\\n)+([\\d,]+\\.\\d{2})',
             'GRAND_TOTAL': r'(?i)Amount\\s*Chargeable\\s*\\(\\s*in\\s*words\\s*\\)(?:\\s|\\n)+Indian\\s*Rupee\\s*([A-Za-z\\s]+)\\s*Only',
-            'LINE_ITEM_TABLE': r'(?s)(?:SI\\s*No\\.|Description|HSN|SAC|Quantity|Rate|Amount|CGST|SGST|Total)(?:.*?)(?=\\nTotal\\s*Taxable Value|Total\\s*Tax\\s*Amount|Amount\\s*Chargeable|Grand\\s*Total|Declaration|E\\.\\s*&\\s*O\\.\\s*E)' # Enhanced end detection
+            'LINE_ITEM_TABLE': r'(?s)(?P<region>(?:SI\\s*No\\.|Description|HSN|SAC|Quantity|Rate|Amount|CGST|SGST|Total)(?:.*?))(?:\\nTotal\\s*Taxable Value|Total\\s*Tax\\s*Amount|Amount\\s*Chargeable|Grand\\s*Total|Declaration|E\\.\\s*&\\s*O\\.\\s*E)' # Enhanced end detection
         }
 
-        # Define regex patterns for labels (for spatial matching)
-        self.label_patterns = {
-            'GSTIN_LABEL': r'(?i)GSTIN(?:/UIN)?',
-            'INVOICE_NO_LABEL': r'(?i)Invoice\\s*No\\.?|Invoice',
-            'DATE_LABEL': r'(?i)Dated|Date',
-            'TOTAL_TAX_LABEL': r'(?i)Total\\s*Tax\\s*Amount|Total\\s*Tax',
-            'GRAND_TOTAL_LABEL': r'(?i)Amount\\s*Chargeable\\s*\\(\\s*in\\s*words\\s*\\)|Grand\\s*Total|Total\\s*Amount',
-            'LINE_ITEM_TABLE_HEADER_KEYWORDS': r'(?i)SI\\s*No\\.|Description|HSN|SAC|Quantity|Rate|Amount|CGST|SGST|Total'
+        # Define keywords for labels (for spatial matching), matched case-insensitively.
+        # The flag says whether the keyword must be the whole word or may appear anywhere in it.
+        self.label_keywords = {
+            'GSTIN_LABEL': (('gstin', 'gstin/uin'), True),
+            'INVOICE_NO_LABEL': (('invoice no.', 'invoice no', 'invoice'), False),
+            'DATE_LABEL': (('dated', 'date'), True),
+            'TOTAL_TAX_LABEL': (('total tax amount', 'total tax'), True),
+            'GRAND_TOTAL_LABEL': (('amount chargeable (in words)', 'grand total', 'total amount'), True)
         }
         # Define regex patterns for values (for spatial matching)
         self.value_patterns = {
             'GSTIN_VALUE': r'[0-9A-Z]{15}',
-            'INVOICE_NO_VALUE': r'[A-Z0-9/.-]+', # Relaxed to allow . and -
+            'INVOICE_NO_VALUE': r'(?=[A-Z/.-]*[0-9])[A-Z0-9][A-Z0-9/.-]{4,19}', # Whole word: 5-20 chars with at least one digit, allowing / . and -
             'DATE_VALUE': r'\\d{1,2}\\s*-\\s*[A-Za-z]+\\s*-\\s*\\d{2}',
             'AMOUNT_VALUE': r'[\\d,]+\\.\\d{2}',
             'WORDS_AMOUNT_VALUE': r'Indian\\s*Rupee\\s*([A-Za-z\\s]+)\\s*Only'
         }
 
-    def box_center(self, box):
-        # box = [x0,y0,x1,y1]
-        return ((box[0]+box[2]) / 2, (box[1]+box[3]) / 2)
-
-    def euclidean(self, a, b):
-        return math.hypot(a[0]-b[0], a[1]-b[1])
-
-    def get_word_boxes_single(self, word_data: Dict, page_width: int, page_height: int) -> List[int]:
-        """Extract normalized bounding box for a single word."""
-        verts = word_data["boundingBox"]["vertices"]
-        x_coords = [v.get("x", 0) for v in verts]
-        y_coords = [v.get("y", 0) for v in verts]
-        
-        x0 = int(min(x_coords) / page_width * 1000)
-        y0 = int(min(y_coords) / page_height * 1000)
-        x1 = int(max(x_coords) / page_width * 1000)
-        y1 = int(max(y_coords) / page_height * 1000)
-        
-        return [x0, y0, x1, y1]
+        # Compile everything once; find_matches runs these against every word of every invoice.
+        # Value patterns stay case-sensitive, as they were when passed to re.fullmatch without flags.
+        self.patterns = {name: _compile_fallback_pattern(p) for name, p in self.patterns.items()}
+        self.value_patterns = {name: re.compile(p) for name, p in self.value_patterns.items()}
+
+        # One Aho-Corasick automaton over every label keyword, so a single scan of
+        # a word finds all the label classes it belongs to
+        keyword_labels = {}
+        for label, (keywords, whole_word) in self.label_keywords.items():
+            for keyword in keywords:
+                keyword_labels.setdefault(keyword, []).append((label, whole_word))
+        self.label_automaton = ahocorasick.Automaton()
+        for keyword, labels in keyword_labels.items():
+            self.label_automaton.add_word(keyword, (len(keyword), labels))
+        self.label_automaton.make_automaton()
+
+    def build_center_tree(self, words: List[Dict]) -> Optional[cKDTree]:
+        """Build a k-d tree over the box centers of words, or None if there are no words."""
+        if not words:
+            return None
+        return cKDTree(np.array([w['center'] for w in words]))
+
+    def nearest_words(self, tree: Optional[cKDTree], words: List[Dict], centers: List[Tuple[float, float]],
+                      max_dist: float) -> List[Optional[Dict]]:
+        """For each center, return the word (of those the tree was built from) nearest to it
+        if closer than max_dist, else None. All centers go to the tree in one batched query."""
+        nearest = [None] * len(centers)
+        if tree is None or not centers:
+            return nearest
+        centers = np.array(centers)
+        dists, idxs = tree.query(centers, distance_upper_bound=max_dist)
+        found = np.flatnonzero(idxs < len(words))
+        if found.size:
+            # Of several equally near words, keep the first one, as the old min() scan did
+            ties = tree.query_ball_point(centers[found], dists[found])
+            for k, candidates in zip(found.tolist(), ties):
+                nearest[k] = words[min(candidates, default=idxs[k])]
+        return nearest
+
+    def normalize_word_boxes(self, vertices: List[List[Tuple[int, int]]], page_dims: List[Tuple[int, int]]) -> List[List[int]]:
+        """Turn each word's four (x, y) vertices into a [x0, y0, x1, y1] box on a 0-1000 page scale."""
+        verts = np.array(vertices, dtype=np.float64).reshape(-1, 4, 2)
+        dims = np.tile(np.array(page_dims, dtype=np.float64).reshape(-1, 2), 2)
+        boxes = np.concatenate([verts.min(axis=1), verts.max(axis=1)], axis=1)
+        return (boxes / dims * 1000).astype(np.int64).tolist()
 
     def extract_text_from_ocr(self, ocr_json: Dict) -> Tuple[str, List[Dict]]:
         """Extract text from OCR JSON while preserving structure and getting character spans for words."""
+        # Line breaks are the two-character '\\n' sequence the region patterns above are
+        # written against. Offsets advance by the real length of every piece appended,
+        # so start_char_idx/end_char_idx always index full_text exactly.
+        line_break = '\\n'
         full_text_parts = []
         word_info_list = []
+        word_vertices = []
+        word_page_dims = []
         current_char_pos = 0
 
         for page in ocr_json.get('pages', []):
@@ -85,71 +173,72 @@ class LabelGenerator:
             page_height = page.get("height", 1)
             for block in page.get('blocks', []):
                 for paragraph in block.get('paragraphs', []):
-                    para_words_text = []
+                    separator = '' # No space before the first word of a paragraph
                     for word_data in paragraph.get('words', []):
                         word_text = ''.join(symbol.get('text', '') for symbol in word_data.get('symbols', []))
                         if word_text.strip():
+                            full_text_parts.append(separator)
+                            current_char_pos += len(separator)
+                            separator = ' '
                             word_info = {
                                 'text': word_text,
-                                'box': self.get_word_boxes_single(word_data, page_width, page_height),
+                                'box': None, # Filled in below, once all boxes are collected
                                 'start_char_idx': current_char_pos,
-                                'end_char_idx': current_char_pos + len(word_text)
+                                'end_char_idx': current_char_pos + len(word_text),
+                                'label': 'O' # Default to Outside, until label_words tags it
                             }
                             word_info_list.append(word_info)
-                            para_words_text.append(word_text)
-                            current_char_pos += len(word_text) + 1  # +1 for space after word
-
-                    if para_words_text:
-                        full_text_parts.append(' '.join(para_words_text))
-                        current_char_pos -= 1 # Remove the last space added if it's the end of a paragraph
-                    full_text_parts.append('\\n')
-                    current_char_pos += 1
-                full_text_parts.append('\\n') # Double newline for block separation
-                current_char_pos += 1
-            full_text_parts.append('\\n') # Triple newline for page separation
-            current_char_pos += 1
+                            word_vertices.append([(v.get("x", 0), v.get("y", 0)) for v in word_data["boundingBox"]["vertices"]])
+                            word_page_dims.append((page_width, page_height))
+                            full_text_parts.append(word_text)
+                            current_char_pos += len(word_text)
+
+                    full_text_parts.append(line_break)
+                    current_char_pos += len(line_break)
+                full_text_parts.append(line_break) # Double newline for block separation
+                current_char_pos += len(line_break)
+            full_text_parts.append(line_break) # Triple newline for page separation
+            current_char_pos += len(line_break)
 
         full_text = ''.join(full_text_parts)
 
-        # No re-alignment needed here, `start_char_idx` and `end_char_idx` are direct.
+        if word_info_list:
+            for word_info, box in zip(word_info_list, self.normalize_word_boxes(word_vertices, word_page_dims)):
+                word_info['box'] = box
+                # Boxes never change, so the center used for all the spatial matching is computed once here
+                word_info['center'] = ((box[0]+box[2]) / 2, (box[1]+box[3]) / 2)
+
         # The .strip() for full_text will be handled by the user of the text if needed.
 
         return full_text, word_info_list
 
-    def find_span_from_word_boxes(self, full_text: str, words_in_span: List[Dict]) -> Optional[Tuple[int, int]]:
-        """Find the start and end character span in full_text for a list of words."""
-        if not words_in_span:
-            return None
-        
-        # Ensure words are sorted by their start_char_idx
-        sorted_words = sorted(words_in_span, key=lambda w: w['start_char_idx'])
-        
-        start_index = sorted_words[0]['start_char_idx']
-        end_index = sorted_words[-1]['end_char_idx']
-        
-        # Validate if the reconstructed text from these words matches the segment in full_text
-        # This is a robustness check. Minor mismatches in whitespace might occur.
-        # Reconstructed text by simply joining might not be identical to full_text segment due to newline handling.
-        # For now, rely on start_char_idx and end_char_idx directly as they are aligned.
-
-        # The original code for `find_span_from_word_boxes` was problematic.
-        # The `word_char_spans` list from `extract_text_from_ocr` should be used directly.
-        
-        return (start_index, end_index)
-
-    def match_label_to_value(self, words, label_regex, value_regex, max_dist=200):
+    def region_span(self, match) -> Tuple[int, int]:
+        """Character span of the region matched by one of the fallback patterns."""
+        return match.span('region') if 'region' in match.re.groupindex else match.span()
+
+    def label_classes(self, text: str) -> set:
+        """Return the label classes (keys of label_keywords) whose keywords match the word text."""
+        text = text.lower()
+        classes = set()
+        for _, (keyword_len, labels) in self.label_automaton.iter(text):
+            for label, whole_word in labels:
+                if not whole_word or keyword_len == len(text):
+                    classes.add(label)
+        return classes
+
+    def match_label_to_value(self, words, word_labels, label_class, value_regex, max_dist=200):
         """Words: list of dicts: [{'text':..., 'box':[x0,y0,x1,y1]}, ...]
-        label_regex: regex for the label word (e.g. r'GSTIN')
-        value_regex: regex for the value token (e.g. r'[0-9A-Z]{15}')
+        word_labels: label_classes() of each word, in the same order as words
+        label_class: label class of the label word (e.g. 'GSTIN_LABEL')
+        value_regex: compiled pattern for the value token (e.g. re.compile(r'[0-9A-Z]{15}'))
         """
-        labels = [w for w in words if re.fullmatch(label_regex, w['text'], re.IGNORECASE)]
-        values = [w for w in words if re.fullmatch(value_regex, w['text'])]
+        labels = [w for w, classes in zip(words, word_labels) if label_class in classes]
+        values = [w for w in words if value_regex.fullmatch(w['text'])]
+        value_tree = self.build_center_tree(values)
         matches = {}
-        for lab in labels:
-            lc = self.box_center(lab['box'])
-            # find the closest value
-            best = min(values, key=lambda v: self.euclidean(lc, self.box_center(v['box'])), default=None)
-            if best and self.euclidean(lc, self.box_center(best['box'])) < max_dist:
+        # find the closest value
+        for lab, best in zip(labels, self.nearest_words(value_tree, values, [lab['center'] for lab in labels], max_dist)):
+            if best:
                 matches[lab['text']] = best # Return the full word_info dict for the value
         return matches
 
@@ -157,96 +246,103 @@ class LabelGenerator:
         """Find matches for each region using spatial proximity and regex fallback."""
         matches = {region: [] for region in REGION_CLASSES}
 
-        # Create a mapping of character positions to word_info for precise lookup
-        char_to_word_info = {}
-        for word_info in words_with_spans:
-            for i in range(word_info['start_char_idx'], word_info['end_char_idx']):
-                char_to_word_info[i] = word_info
+        # Label classes of every word, from one automaton scan per word
+        word_labels = [self.label_classes(w['text']) for w in words_with_spans]
+
+        # Word geometry as arrays, so the header scan below filters every word in one NumPy step
+        word_boxes = np.array([w['box'] for w in words_with_spans], dtype=np.int32).reshape(-1, 4)
+        word_centers_x = (word_boxes[:, 0] + word_boxes[:, 2]) / 2
 
         # --- Spatial Matching for specific fields ---
 
         # INVOICE_NO
         # Using a more robust spatial approach for INVOICE_NO
-        invoice_no_label_words = [w for w in words_with_spans if re.search(self.label_patterns['INVOICE_NO_LABEL'], w['text'], re.IGNORECASE)]
-        invoice_no_value_words = [w for w in words_with_spans if re.search(self.value_patterns['INVOICE_NO_VALUE'], w['text'])]
-
-        for label_word in invoice_no_label_words:
-            lc = self.box_center(label_word['box'])
-            best_value_word = min(
-                invoice_no_value_words,
-                key=lambda v: self.euclidean(lc, self.box_center(v['box'])),
-                default=None
-            )
-            if best_value_word and self.euclidean(lc, self.box_center(best_value_word['box'])) < 150: # max_dist for invoice number
+        invoice_no_label_words = [w for w, classes in zip(words_with_spans, word_labels) if 'INVOICE_NO_LABEL' in classes]
+        invoice_no_value_words = [w for w in words_with_spans if self.value_patterns['INVOICE_NO_VALUE'].fullmatch(w['text'])]
+        invoice_no_value_tree = self.build_center_tree(invoice_no_value_words)
+
+        invoice_no_best_values = self.nearest_words(
+            invoice_no_value_tree,
+            invoice_no_value_words,
+            [w['center'] for w in invoice_no_label_words],
+            150 # max_dist for invoice number
+        )
+
+        for label_word, best_value_word in zip(invoice_no_label_words, invoice_no_best_values):
+            if best_value_word:
                 # Combine label and value for the span
                 combined_words = sorted([label_word, best_value_word], key=lambda w: w['start_char_idx'])
-                span = self.find_span_from_word_boxes(full_text, combined_words)
-                if span:
-                    matches['INVOICE_NO'].append(span)
+                matches['INVOICE_NO'].append((combined_words[0]['start_char_idx'], combined_words[-1]['end_char_idx']))
                 break # Assuming one invoice number
 
         # INVOICE_DATE
-        invoice_date_matches_spatial = self.match_label_to_value(words_with_spans, self.label_patterns['DATE_LABEL'], self.value_patterns['DATE_VALUE'])
+        invoice_date_matches_spatial = self.match_label_to_value(words_with_spans, word_labels, 'DATE_LABEL', self.value_patterns['DATE_VALUE'])
         for label_text, value_word_info in invoice_date_matches_spatial.items():
             label_word_info = next((w for w in words_with_spans if w['text'] == label_text), None)
             if label_word_info:
                 combined_words = sorted([label_word_info, value_word_info], key=lambda w: w['start_char_idx'])
-                span = self.find_span_from_word_boxes(full_text, combined_words)
-                if span:
-                    matches['INVOICE_DATE'].append(span)
+                matches['INVOICE_DATE'].append((combined_words[0]['start_char_idx'], combined_words[-1]['end_char_idx']))
                 break
 
         # TOTAL_TAX
-        total_tax_matches_spatial = self.match_label_to_value(words_with_spans, self.label_patterns['TOTAL_TAX_LABEL'], self.value_patterns['AMOUNT_VALUE'])
+        total_tax_matches_spatial = self.match_label_to_value(words_with_spans, word_labels, 'TOTAL_TAX_LABEL', self.value_patterns['AMOUNT_VALUE'])
         for label_text, value_word_info in total_tax_matches_spatial.items():
             label_word_info = next((w for w in words_with_spans if w['text'] == label_text), None)
             if label_word_info:
                 combined_words = sorted([label_word_info, value_word_info], key=lambda w: w['start_char_idx'])
-                span = self.find_span_from_word_boxes(full_text, combined_words)
-                if span:
-                    matches['TOTAL_TAX'].append(span)
+                matches['TOTAL_TAX'].append((combined_words[0]['start_char_idx'], combined_words[-1]['end_char_idx']))
                 break
         
         # GRAND_TOTAL
-        grand_total_matches_spatial = self.match_label_to_value(words_with_spans, self.label_patterns['GRAND_TOTAL_LABEL'], self.value_patterns['AMOUNT_VALUE'])
+        grand_total_matches_spatial = self.match_label_to_value(words_with_spans, word_labels, 'GRAND_TOTAL_LABEL', self.value_patterns['AMOUNT_VALUE'])
         for label_text, value_word_info in grand_total_matches_spatial.items():
             label_word_info = next((w for w in words_with_spans if w['text'] == label_text), None)
             if label_word_info:
                 combined_words = sorted([label_word_info, value_word_info], key=lambda w: w['start_char_idx'])
-                span = self.find_span_from_word_boxes(full_text, combined_words)
-                if span:
-                    matches['GRAND_TOTAL'].append(span)
+                matches['GRAND_TOTAL'].append((combined_words[0]['start_char_idx'], combined_words[-1]['end_char_idx']))
                 break
 
         # SELLER_INFO, BILL_TO, SHIP_TO - Enhanced Spatial matching for GSTINs and surrounding text
-        gstin_labels = [w for w in words_with_spans if re.fullmatch(self.label_patterns['GSTIN_LABEL'], w['text'], re.IGNORECASE)]
-        gstin_values = [w for w in words_with_spans if re.fullmatch(self.value_patterns['GSTIN_VALUE'], w['text'])]
-
-        for label_word in gstin_labels:
-            lc = self.box_center(label_word['box'])
-            best_gstin_value_word = min(
-                gstin_values,
-                key=lambda v: self.euclidean(lc, self.box_center(v['box'])),
-                default=None
-            )
-
-            if best_gstin_value_word and self.euclidean(lc, self.box_center(best_gstin_value_word['box'])) < 300: # Increased max_dist for GSTIN
+        gstin_labels = [w for w, classes in zip(words_with_spans, word_labels) if 'GSTIN_LABEL' in classes]
+        gstin_values = [w for w in words_with_spans if self.value_patterns['GSTIN_VALUE'].fullmatch(w['text'])]
+        gstin_value_tree = self.build_center_tree(gstin_values)
+        gstin_best_values = self.nearest_words(
+            gstin_value_tree,
+            gstin_values,
+            [w['center'] for w in gstin_labels],
+            300 # Increased max_dist for GSTIN
+        )
+
+        for label_word, best_gstin_value_word in zip(gstin_labels, gstin_best_values):
+            # Header words only ever fill a party region that is still empty, and the
+            # regions only change below, after the scan; once all three are filled
+            # the remaining GSTIN labels can't add anything
+            need_bill_to = not matches['BILL_TO']
+            need_ship_to = not matches['SHIP_TO']
+            need_seller_info = not matches['SELLER_INFO']
+            if not (need_bill_to or need_ship_to or need_seller_info):
+                break
+
+            if best_gstin_value_word:
                 gstin_value_box = best_gstin_value_word['box']
                 
                 # Check for "Buyer" / "Consignee" / "Seller" in words vertically above and horizontally aligned
                 relevant_header_words = []
-                for w in words_with_spans:
-                    # Check if word is roughly above the GSTIN value and within a reasonable horizontal range
-                    if w['box'][3] < gstin_value_box[1] and \
-                       abs(self.box_center(w['box'])[0] - self.box_center(gstin_value_box)[0]) < 150: # Increased horizontal range
-                        
-                        if re.search(r'(?i)Buyer|Bill\\s*to', w['text']) and not matches.get('BILL_TO'):
-                            relevant_header_words.append({'type': 'BILL_TO', 'word': w})
-                        elif re.search(r'(?i)Consignee|Ship\\s*to', w['text']) and not matches.get('SHIP_TO'):
-                            relevant_header_words.append({'type': 'SHIP_TO', 'word': w})
-                        elif re.search(r'(?i)Surabhi\\s*Hardwares|Seller|Our\\s*GSTIN', w['text']) or \
-                             ('GSTIN' in label_word['text'] and w['box'][1] < label_word['box'][1]) and not matches.get('SELLER_INFO'): # Heuristic for seller info: nearby text before GSTIN label
-                            relevant_header_words.append({'type': 'SELLER_INFO', 'word': w})
+                # Heuristic for seller info: nearby text before GSTIN label
+                seller_label_top = label_word['box'][1] if 'GSTIN' in label_word['text'] else None
+                # Words roughly above the GSTIN value and within a reasonable horizontal range;
+                # the cheap geometric test runs first so the regexes only see these few words
+                above_gstin = (word_boxes[:, 3] < gstin_value_box[1]) & \
+                              (np.abs(word_centers_x - best_gstin_value_word['center'][0]) < 150) # Increased horizontal range
+                for i in np.flatnonzero(above_gstin).tolist():
+                    w = words_with_spans[i]
+                    if need_bill_to and _BUYER_RE.search(w['text']):
+                        relevant_header_words.append({'type': 'BILL_TO', 'word': w})
+                    elif need_ship_to and _CONSIGNEE_RE.search(w['text']):
+                        relevant_header_words.append({'type': 'SHIP_TO', 'word': w})
+                    elif need_seller_info and (_SELLER_RE.search(w['text']) or
+                                               (seller_label_top is not None and w['box'][1] < seller_label_top)):
+                        relevant_header_words.append({'type': 'SELLER_INFO', 'word': w})
 
                 # Sort header words by their vertical position to get the top-most
                 relevant_header_words.sort(key=lambda x: x['word']['box'][1])
@@ -257,175 +353,118 @@ class LabelGenerator:
 
                     # Define span from header word to GSTIN value word
                     combined_words_for_region = sorted([header_word, best_gstin_value_word], key=lambda w: w['start_char_idx'])
-                    span = self.find_span_from_word_boxes(full_text, combined_words_for_region)
-                    
-                    if span:
-                        if header_type == 'SELLER_INFO' and not matches.get('SELLER_INFO'):
-                            matches['SELLER_INFO'].append(span)
-                            # Also try to include the actual business name for SELLER_INFO
-                            seller_name_match = re.search(r'(?i)([^\\n]+(?:Hardwares|Traders|Enterprises|Pvt\\.?\\s*Ltd\\.?)[^\\n]*)(?:\\s*\\n{1,2}(?:[^\\n]*\\n){0,3}GSTIN)', full_text[span[0]:])
-                            if seller_name_match:
-                                new_span = (span[0] + seller_name_match.start(1), span[0] + seller_name_match.end(1))
-                                matches['SELLER_INFO'][-1] = new_span # Replace with more precise span
-                            break
-                        elif header_type == 'BILL_TO' and not matches.get('BILL_TO'):
-                            matches['BILL_TO'].append(span)
-                            # Try to expand to include name/address if not already captured
-                            bill_to_name_match = re.search(r'(?i)(Buyer\\s*\\(\\s*Bill\\s*to\\s*\\)(?:\\s*|\\n*):?(?:\\s*|\\n*)(.*?))(?:\\s*|\\n*)GSTIN', full_text[span[0]:])
-                            if bill_to_name_match:
-                                new_span = (span[0] + bill_to_name_match.start(1), span[0] + bill_to_name_match.end(1))
-                                matches['BILL_TO'][-1] = new_span
-                            break
-                        elif header_type == 'SHIP_TO' and not matches.get('SHIP_TO'):
-                            matches['SHIP_TO'].append(span)
-                            # Try to expand to include name/address if not already captured
-                            ship_to_name_match = re.search(r'(?i)(Consignee\\s*\\(\\s*Ship\\s*to\\s*\\)(?:\\s*|\\n*):?(?:\\s*|\\n*)(.*?))(?:\\s*|\\n*)GSTIN', full_text[span[0]:])
-                            if ship_to_name_match:
-                                new_span = (span[0] + ship_to_name_match.start(1), span[0] + ship_to_name_match.end(1))
-                                matches['SHIP_TO'][-1] = new_span
-                            break
+                    span = (combined_words_for_region[0]['start_char_idx'], combined_words_for_region[-1]['end_char_idx'])
+
+                    if header_type == 'SELLER_INFO' and not matches.get('SELLER_INFO'):
+                        matches['SELLER_INFO'].append(span)
+                        # Also try to include the actual business name for SELLER_INFO
+                        seller_name_match = _SELLER_NAME_RE.search(full_text[span[0]:])
+                        if seller_name_match:
+                            new_span = (span[0] + seller_name_match.start(1), span[0] + seller_name_match.end(1))
+                            matches['SELLER_INFO'][-1] = new_span # Replace with more precise span
+                        break
+                    elif header_type == 'BILL_TO' and not matches.get('BILL_TO'):
+                        matches['BILL_TO'].append(span)
+                        # Try to expand to include name/address if not already captured
+                        bill_to_name_match = _BILL_TO_NAME_RE.search(full_text[span[0]:])
+                        if bill_to_name_match:
+                            new_span = (span[0] + bill_to_name_match.start(1), span[0] + bill_to_name_match.end(1))
+                            matches['BILL_TO'][-1] = new_span
+                        break
+                    elif header_type == 'SHIP_TO' and not matches.get('SHIP_TO'):
+                        matches['SHIP_TO'].append(span)
+                        # Try to expand to include name/address if not already captured
+                        ship_to_name_match = _SHIP_TO_NAME_RE.search(full_text[span[0]:])
+                        if ship_to_name_match:
+                            new_span = (span[0] + ship_to_name_match.start(1), span[0] + ship_to_name_match.end(1))
+                            matches['SHIP_TO'][-1] = new_span
+                        break
 
         # LINE_ITEM_TABLE detection with enhanced spatial analysis
-        table_header_keywords = [w for w in words_with_spans if re.search(self.label_patterns['LINE_ITEM_TABLE_HEADER_KEYWORDS'], w['text'])]
+        table_header_keywords = [w for w in words_with_spans if w['text'].lower().strip('.:') in _TABLE_HEADER_WORDS]
         
         if table_header_keywords:
             table_header_keywords.sort(key=lambda w: w['box'][1])
             table_start = table_header_keywords[0]['start_char_idx']
             
             # Find the end of the table by looking for the start of the summary section
-            summary_start_keywords_patterns = [
-                r'(?i)Total\\s*Taxable\\s*Value',
-                r'(?i)Total\\s*Tax\\s*Amount',
-                r'(?i)Amount\\s*Chargeable\\s*\\(\\s*in\\s*words\\s*\\)',
-                r'(?i)Grand\\s*Total',
-                r'(?i)Declaration',
-                r'(?i)E\\.\\s*&\\s*O\\.\\s*E' # Added another common end marker
-            ]
-            
-            table_end = None
-            min_summary_start_idx = float('inf')
+            # (the first marker starting strictly after the table start)
+            summary_match = _SUMMARY_END_RE.search(full_text, table_start + 1)
+            table_end = summary_match.start(0) if summary_match else None
 
-            for keyword_pattern in summary_start_keywords_patterns:
-                for match in re.finditer(keyword_pattern, full_text):
-                    if match.start(0) > table_start:
-                        min_summary_start_idx = min(min_summary_start_idx, match.start(0))
-            
-            if min_summary_start_idx != float('inf'):
-                table_end = min_summary_start_idx
-            
             if table_end:
                 matches['LINE_ITEM_TABLE'].append((table_start, table_end))
             else:
                 # Fallback to regex if spatial matching for end fails
-                table_match = re.search(self.patterns['LINE_ITEM_TABLE'], full_text)
+                table_match = self.patterns['LINE_ITEM_TABLE'].search(full_text)
                 if table_match:
-                    matches['LINE_ITEM_TABLE'].append((table_match.start(0), table_match.end(0)))
+                    matches['LINE_ITEM_TABLE'].append(self.region_span(table_match))
 
         # Fallback to regex patterns for any unmatched regions
         for region in REGION_CLASSES:
             if not matches[region]:
                 pattern = self.patterns.get(region)
                 if pattern:
-                    match = re.search(pattern, full_text)
+                    match = pattern.search(full_text)
                     if match:
-                        matches[region].append((match.start(0), match.end(0)))
+                        matches[region].append(self.region_span(match))
 
         return matches
 
-    def align_spans_to_words(self, full_text: str, spans: Dict[str, List[Tuple[int, int]]], 
-                           words_with_spans: List[Dict]) -> Dict[str, List[Dict]]:
-        """Align regex spans to OCR words and their boxes using character indices."""
-        region_words = {region: [] for region in REGION_CLASSES}
-        
-        # Create a mapping of character positions to word_info for precise lookup
-        char_to_word_info = {}
-        for word_info in words_with_spans:
-            for i in range(word_info['start_char_idx'], word_info['end_char_idx']):
-                char_to_word_info[i] = word_info
-
-        # Map spans to words
-        for region, region_spans in spans.items():
-            for start, end in region_spans:
-                unique_words_for_span = []
-                for char_idx in range(start, end):
-                    if char_idx in char_to_word_info:
-                        word_obj = char_to_word_info[char_idx]
-                        if word_obj not in unique_words_for_span:
-                            unique_words_for_span.append(word_obj)
-                region_words[region].extend(unique_words_for_span)
-        
-        return region_words
-
-    def generate_training_manifest(self, region_words: Dict[str, List[Dict]], words_with_spans: List[Dict]) -> Dict:
-        """Generate training manifest in the required format with BIO tagging."""
-        manifest = {
-            "regions": [],
-            "tokens": []
-        }
+    def label_words(self, spans: Dict[str, List[Tuple[int, int]]], words_with_spans: List[Dict]) -> List[Dict]:
+        """Write each region word's BIO label onto its word_info and return the manifest regions.
 
-        # Create a mapping of character indices to word_info for quick lookup
-        # This will be used to map tokens from LayoutLMv3Processor to actual words
-        full_text_words_map = {word['start_char_idx']: word for word in words_with_spans}
-
-        # Initialize all words with 'O' (Outside) label
-        # Use a list of dictionaries to store tokens, so we can modify labels easily
-        tokens_with_labels = []
-        for word_info in words_with_spans:
-            tokens_with_labels.append({
-                "text": word_info["text"],
-                "box": word_info["box"],
-                "label": "O" # Default to Outside
-            })
-
-        # Iterate through regions and apply BIO tags
-        for region_type, words_in_region in region_words.items():
+        Spans are mapped to words and tagged in one pass per region, in REGION_CLASSES
+        order, so where regions overlap the later one's labels win.
+        """
+        # Words never overlap, so sorted by start their ends are sorted too and the
+        # words touching a span form one contiguous run that bisect can find
+        words = sorted(words_with_spans, key=lambda w: w['start_char_idx'])
+        starts = [w['start_char_idx'] for w in words]
+        ends = [w['end_char_idx'] for w in words]
+
+        regions = []
+        for region_type in REGION_CLASSES:
+            words_in_region = []
+            for start, end in spans.get(region_type, []):
+                # First word ending after the span starts, up to the first word starting at or after its end
+                words_in_region.extend(words[bisect_right(ends, start):bisect_left(starts, end)])
             if not words_in_region:
                 continue
 
             # Sort words by their start_char_idx to ensure correct B-I-O sequence
             words_in_region.sort(key=lambda w: w['start_char_idx'])
 
-            is_first_word_in_region = True
-            for word in words_in_region:
-                # Find the corresponding token in tokens_with_labels and apply BIO tag
-                # This is a simplified matching; more robust would involve token-level alignment
-                for i, token_entry in enumerate(tokens_with_labels):
-                    if token_entry["text"] == word["text"] and token_entry["box"] == word["box"]:
-                        if is_first_word_in_region:
-                            tokens_with_labels[i]["label"] = f"B-{region_type}"
-                            is_first_word_in_region = False
-                        else:
-                            tokens_with_labels[i]["label"] = f"I-{region_type}"
-                        # Break after finding and labeling the first match for this word
-                        break
-            
+            words_in_region[0]['label'] = f"B-{region_type}"
+            for word in words_in_region[1:]:
+                word['label'] = f"I-{region_type}"
+
             # Add regions (union of word boxes) to manifest
-            try:
-                x0 = min(w["box"][0] for w in words_in_region)
-                y0 = min(w["box"][1] for w in words_in_region)
-                x1 = max(w["box"][2] for w in words_in_region)
-                y1 = max(w["box"][3] for w in words_in_region)
-            except ValueError: # Handle case where words_in_region might be empty for some reason
-                self.logger.warning(f"No words found for region {region_type} during manifest generation. Skipping region.")
-                continue
-            
-            manifest["regions"].append({
+            region_boxes = np.array([w["box"] for w in words_in_region])
+            region_box = np.concatenate([region_boxes[:, :2].min(axis=0), region_boxes[:, 2:].max(axis=0)])
+
+            regions.append({
                 "class": region_type,
-                "box": [x0, y0, x1, y1],
+                "box": region_box.tolist(),
                 "words": [w["text"] for w in words_in_region]
             })
 
-        # Add all tokens with their assigned BIO labels to the manifest
-        manifest["tokens"] = tokens_with_labels
-        
-        return manifest
+        return regions
+
+    def generate_training_manifest(self, regions: List[Dict], words_with_spans: List[Dict]) -> Dict:
+        """Generate training manifest in the required format from words already tagged by label_words."""
+        return {
+            "regions": regions,
+            "tokens": [{"text": w["text"], "box": w["box"], "label": w["label"]} for w in words_with_spans]
+        }
 
     def process_invoice(self, file_path: str) -> Dict:
         """Process a single invoice and return its manifest entry."""
         # Load OCR JSON
         try:
-            with open(file_path, 'r') as f:
-                ocr_json = json.load(f)
+            with open(file_path, 'rb') as f:
+                data = f.read()
+            ocr_json = orjson.loads(data) if orjson is not None else json.loads(data)
         except Exception as e:
             logger.error(f"Error loading OCR JSON from {file_path}: {e}")
             return None
@@ -447,29 +486,34 @@ class LabelGenerator:
             else:
                 logger.info(f"{region}: No matches found")
         
-        # Align spans to words
-        region_words = self.align_spans_to_words(full_text, spans, words_with_spans)
+        # Tag words with their BIO labels
+        regions = self.label_words(spans, words_with_spans)
         
         # Generate manifest
-        manifest = self.generate_training_manifest(region_words, words_with_spans)
+        manifest = self.generate_training_manifest(regions, words_with_spans)
         
         return manifest
 
-    def process_all_invoices(self) -> List[Dict]:
-        """Process all invoices in the directory."""
+    def process_all_invoices(self, max_workers: Optional[int] = None) -> List[Dict]:
+        """Process all invoices in the directory, spread over max_workers processes (default: one per CPU)."""
+        filenames = [
+            filename for filename in os.listdir(self.json_dir)
+            if filename.endswith('.json') and not filename.startswith('training_manifest')
+        ]
+        file_paths = [os.path.join(self.json_dir, filename) for filename in filenames]
+
         manifests = []
-        for filename in os.listdir(self.json_dir):
-            if filename.endswith('.json') and not filename.startswith('training_manifest'):
-                file_path = os.path.join(self.json_dir, filename)
-                logger.info(f"Processing {filename}...")
-                
-                manifest = self.process_invoice(file_path)
+        # Invoices are independent of each other, so each one can go to its own worker;
+        # map() still yields the results in directory order
+        with ProcessPoolExecutor(max_workers=max_workers or os.cpu_count()) as executor:
+            for filename, manifest in zip(filenames, executor.map(self.process_invoice, file_paths)):
+                logger.info(f"Processed {filename}")
                 if manifest:
                     manifest["file_name"] = filename
                     manifests.append(manifest)
                 else:
                     logger.error(f"Failed to process {filename}")
-        
+
         return manifests
 
 def main():
@@ -481,9 +525,13 @@ def main():
     generator = LabelGenerator(json_dir)
     manifests = generator.process_all_invoices()
     
-    # Save the combined manifest
-    with open(output_file, 'w', encoding='utf-8') as f:
-        json.dump(manifests, f, indent=2)
+    # Save the combined manifest; orjson serializes it in one call straight to bytes
+    if orjson is not None:
+        with open(output_file, 'wb') as f:
+            f.write(orjson.dumps(manifests, option=orjson.OPT_INDENT_2))
+    else:
+        with open(output_file, 'w', encoding='utf-8') as f:
+            json.dump(manifests, f, indent=2)
     
     logger.info(f"Generated training manifest with {len(manifests)} invoices")
     logger.info(f"Manifest saved to {output_file}")
@@ -1,113 +1,249 @@
 import os
 import json
+import gzip
+import argparse
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Tesseract spreads each image over all cores with OpenMP, which only gets in the
+# way when several images are OCR'd at once; we parallelize across images instead.
+os.environ.setdefault("OMP_THREAD_LIMIT", "1")
+
 import pytesseract
-from PIL import Image
 import cv2
 import numpy as np
 
+try:
+    # orjson encodes straight to UTF-8 bytes and is several times faster than json
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    # tesserocr links libtesseract in-process, so the language data is loaded once
+    # per thread instead of once per pytesseract subprocess
+    from tesserocr import PyTessBaseAPI, PSM, RIL, iterate_level
+except ImportError:
+    PyTessBaseAPI = None
+
 # Define paths
 IMAGE_TEMPLATES_DIR = "Invoice Templates"
 OCR_JSON_OUTPUT_DIR = "backend/invoices/ml_layoutlm"
 
-def normalize_box(box, width, height):
-    return [
-        int(1000 * (box[0] / width)),
-        int(1000 * (box[1] / height)),
-        int(1000 * (box[2] / width)),
-        int(1000 * (box[3] / height)),
-    ]
+def normalize_box(boxes, width, height):
+    """Scale an (N, 4) array of pixel [x0, y0, x1, y1] boxes to the 0-1000 LayoutLM grid."""
+    return (np.asarray(boxes) / np.array([width, height, width, height]) * 1000).astype(np.int32)
+
+def build_ocr_json(data, image_width, image_height):
+    """Turn pytesseract's image_to_data dict for one image into our OCR JSON structure."""
+    # Initialize JSON structure
+    ocr_json = {
+        "pages": [
+            {
+                "page_num": 1,
+                "width": image_width,
+                "height": image_height,
+                "blocks": []
+            }
+        ]
+    }
+
+    # Drop Tesseract's empty rows (pages/blocks/lines and blank words)
+    texts = np.char.strip(np.asarray(data["text"], dtype=str))
+    mask = np.char.str_len(texts) > 0
+    if not mask.any():
+        return ocr_json
+
+    # Extract bounding boxes from tesseract data and normalize them to 1000x1000 scale
+    left, top = np.asarray(data["left"])[mask], np.asarray(data["top"])[mask]
+    right, bottom = left + np.asarray(data["width"])[mask], top + np.asarray(data["height"])[mask]
+    boxes = normalize_box(np.stack([left, top, right, bottom], axis=1), image_width, image_height)
 
-def generate_ocr_json_from_image(image_path, output_dir):
+    # Group words into lines and blocks (a simplified approach for now)
+    # In a real scenario, you might want more sophisticated block/line detection
+    # The line (and the block holding it) covers the union of its word bboxes
+    line_bbox = boxes[:, :2].min(axis=0).tolist() + boxes[:, 2:].max(axis=0).tolist()
+    current_line = {
+        "bbox": line_bbox,
+        "words": [
+            {"text": text, "bbox": bbox}
+            for text, bbox in zip(texts[mask].tolist(), boxes.tolist())
+        ]
+    }
+    ocr_json["pages"][0]["blocks"].append({"bbox": list(line_bbox), "lines": [current_line]})
+
+    return ocr_json
+
+def save_ocr_json(ocr_json, image_path, output_dir, compress=False):
+    image_filename = os.path.basename(image_path)
+    output_filepath = os.path.join(output_dir, f"{os.path.splitext(image_filename)[0]}_ocr_json.json")
+
+    # Compact output, encoded in one go and written with a single call: the files
+    # are read by scripts, not people
+    if orjson is not None:
+        data = orjson.dumps(ocr_json)
+    else:
+        data = json.dumps(ocr_json, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    if compress:
+        # Fast gzip level; the repetitive JSON still shrinks by an order of magnitude
+        output_filepath += ".gz"
+        f = gzip.open(output_filepath, 'wb', compresslevel=1)
+    else:
+        f = open(output_filepath, 'wb')
+    with f:
+        f.write(data)
+    print(f"Successfully generated OCR JSON for {image_path} to {output_filepath}")
+
+# One PyTessBaseAPI per thread: an instance is not safe to share, but separate
+# instances can run concurrently
+_tess_local = threading.local()
+
+def _get_tess_api():
+    api = getattr(_tess_local, "api", None)
+    if api is None:
+        api = _tess_local.api = PyTessBaseAPI(psm=PSM.AUTO, lang='eng')
+    return api
+
+def tesserocr_image_to_data(image):
+    """OCR an RGB uint8 array with tesserocr, returning the word columns of pytesseract's image_to_data dict."""
+    api = _get_tess_api()
+    height, width = image.shape[:2]
+    # Hand the pixel buffer over directly rather than going through a PIL image
+    api.SetImageBytes(image.tobytes(), width, height, 3, 3 * width)
+    api.Recognize()
+    data = {"text": [], "left": [], "top": [], "width": [], "height": []}
+    iterator = api.GetIterator()
+    if iterator is None:
+        return data
+    for word in iterate_level(iterator, RIL.WORD):
+        text = word.GetUTF8Text(RIL.WORD)
+        box = word.BoundingBox(RIL.WORD)
+        if not text or box is None:
+            continue
+        x0, y0, x1, y1 = box
+        data["text"].append(text)
+        data["left"].append(x0)
+        data["top"].append(y0)
+        data["width"].append(x1 - x0)
+        data["height"].append(y1 - y0)
+    return data
+
+def generate_ocr_json_from_image(image_path, output_dir, compress=False):
     try:
-        # Open the image using PIL
-        image = Image.open(image_path).convert("RGB")
-        image_width, image_height = image.size
-
-        # Perform OCR using pytesseract
-        data = pytesseract.image_to_data(image, output_type=pytesseract.Output.DICT)
-
-        # Initialize JSON structure
-        ocr_json = {
-            "pages": [
-                {
-                    "page_num": 1,
-                    "width": image_width,
-                    "height": image_height,
-                    "blocks": []
-                }
-            ]
-        }
-
-        # Group words into lines and blocks (a simplified approach for now)
-        # In a real scenario, you might want more sophisticated block/line detection
-        current_block = {"bbox": [0, 0, image_width, image_height], "lines": []}
-        current_line = {"bbox": [0, 0, image_width, image_height], "words": []}
-
-        for i in range(len(data["text"])):
-            word_text = data["text"][i].strip()
-            if not word_text:
-                continue
-
-            # Extract bounding box from tesseract data
-            x, y, w, h = data["left"][i], data["top"][i], data["width"][i], data["height"][i]
-            bbox = [x, y, x + w, y + h]
-
-            # Normalize bounding box to 1000x1000 scale
-            normalized_bbox = normalize_box(bbox, image_width, image_height)
-
-            current_line["words"].append({
-                "text": word_text,
-                "bbox": normalized_bbox # Store normalized bbox
-            })
-
-        # Add the last line and block
-        if current_line["words"]:
-            # Calculate bbox for the entire line (simple union of word bboxes)
-            all_x = [word["bbox"][0] for word in current_line["words"]]
-            all_y = [word["bbox"][1] for word in current_line["words"]]
-            all_x2 = [word["bbox"][2] for word in current_line["words"]]
-            all_y2 = [word["bbox"][3] for word in current_line["words"]]
-            if all_x and all_y and all_x2 and all_y2:
-                current_line["bbox"] = [
-                    min(all_x),
-                    min(all_y),
-                    max(all_x2),
-                    max(all_y2)
-                ]
-            current_block["lines"].append(current_line)
-        
-        if current_block["lines"]:
-            # Calculate bbox for the entire block
-            all_x = [line["bbox"][0] for line in current_block["lines"]]
-            all_y = [line["bbox"][1] for line in current_block["lines"]]
-            all_x2 = [line["bbox"][2] for line in current_block["lines"]]
-            all_y2 = [line["bbox"][3] for line in current_block["lines"]]
-            if all_x and all_y and all_x2 and all_y2:
-                current_block["bbox"] = [
-                    min(all_x),
-                    min(all_y),
-                    max(all_x2),
-                    max(all_y2)
-                ]
-            ocr_json["pages"][0]["blocks"].append(current_block)
+        # Decode straight into a uint8 array; OpenCV loads BGR, Tesseract expects RGB
+        image = cv2.imread(image_path, cv2.IMREAD_COLOR)
+        if image is None:
+            raise ValueError("could not read image")
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+        image_height, image_width = image.shape[:2]
+
+        # Perform OCR in-process with tesserocr when available, otherwise via pytesseract
+        if PyTessBaseAPI is not None:
+            data = tesserocr_image_to_data(image)
+        else:
+            data = pytesseract.image_to_data(image, output_type=pytesseract.Output.DICT)
 
         # Save the JSON file
-        image_filename = os.path.basename(image_path)
-        output_filepath = os.path.join(output_dir, f"{os.path.splitext(image_filename)[0]}_ocr_json.json")
-        
-        with open(output_filepath, 'w', encoding='utf-8') as f:
-            json.dump(ocr_json, f, indent=4, ensure_ascii=False)
-        print(f"Successfully generated OCR JSON for {image_path} to {output_filepath}")
+        save_ocr_json(build_ocr_json(data, image_width, image_height), image_path, output_dir, compress)
 
     except Exception as e:
         print(f"Error processing {image_path}: {e}")
 
+def split_tsv_pages(data):
+    """Split an image_to_data style dict covering several pages into one dict per page, in page order."""
+    rows_by_page = {}
+    for i, page_num in enumerate(data.get("page_num", [])):
+        rows_by_page.setdefault(page_num, []).append(i)
+    return [
+        {key: [values[i] for i in rows] for key, values in data.items()}
+        for _, rows in sorted(rows_by_page.items())
+    ]
+
+def generate_ocr_jsons_batched(image_paths, output_dir, compress=False):
+    """OCR all images with a single Tesseract process instead of one per image.
+
+    Tesseract accepts a text file listing images, loads its language data once and
+    emits one TSV in which each image is a consecutive page. If the pages don't line
+    up with the images (e.g. one could not be read), fall back to one call per image.
+    """
+    if not image_paths:
+        return
+
+    with tempfile.NamedTemporaryFile('w', suffix='.txt', encoding='utf-8', delete=False) as f:
+        f.write('\n'.join(os.path.abspath(p) for p in image_paths) + '\n')
+        list_path = f.name
+    try:
+        tsv = pytesseract.run_and_get_output(list_path, extension='tsv', config='-c tessedit_create_tsv=1')
+        pages = split_tsv_pages(pytesseract.pytesseract.file_to_dict(tsv, '\t', -1))
+    except Exception as e:
+        print(f"Error running batched OCR: {e}")
+        pages = []
+    finally:
+        os.remove(list_path)
+
+    if len(pages) != len(image_paths):
+        print(f"Batched OCR returned {len(pages)} pages for {len(image_paths)} images, processing them one by one")
+        for image_path in image_paths:
+            generate_ocr_json_from_image(image_path, output_dir, compress)
+        return
+
+    for image_path, data in zip(image_paths, pages):
+        try:
+            # The page-level row (level 1) spans the whole image
+            page_row = data["level"].index(1)
+            image_width, image_height = data["width"][page_row], data["height"][page_row]
+            save_ocr_json(build_ocr_json(data, image_width, image_height), image_path, output_dir, compress)
+        except Exception as e:
+            print(f"Error processing {image_path}: {e}")
+
+def default_workers():
+    # Roughly one Tesseract worker per 4 cores
+    return max(1, (os.cpu_count() or 1) // 4)
+
+def generate_ocr_jsons(image_paths, output_dir, workers=None, compress=False):
+    """OCR image_paths across a pool of threads.
+
+    Tesseract runs in its own process (and releases the GIL in the C layer), so
+    threads are enough. With tesserocr every thread keeps its own Tesseract instance
+    warm and takes images one at a time; otherwise images are split into one batch
+    per worker and each batch is a single Tesseract run.
+    """
+    workers = workers or default_workers()
+    if PyTessBaseAPI is not None:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(lambda p: generate_ocr_json_from_image(p, output_dir, compress), image_paths))
+        return
+
+    # Neither Tesseract nor OpenCV can decode PDFs, so a PDF is kept out of the
+    # batches (where it would push its whole batch onto the per-image fallback) and
+    # is only reported as unreadable by the per-image path
+    pdf_paths = [p for p in image_paths if p.lower().endswith('.pdf')]
+    other_paths = [p for p in image_paths if not p.lower().endswith('.pdf')]
+    batches = [other_paths[i::workers] for i in range(workers) if other_paths[i::workers]]
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(generate_ocr_jsons_batched, batch, output_dir, compress) for batch in batches]
+        futures += [executor.submit(generate_ocr_json_from_image, p, output_dir, compress) for p in pdf_paths]
+        for future in futures:
+            future.result()
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate OCR JSONs for the invoice template images.")
+    parser.add_argument('--workers', type=int, default=default_workers(),
+                        help='Number of images to OCR in parallel (default: CPU count / 4)')
+    parser.add_argument('--gzip', action='store_true',
+                        help='Write .json.gz archives instead of .json (the labelling/training scripts read plain .json)')
+    args = parser.parse_args()
+
     # Ensure output directory exists
     os.makedirs(OCR_JSON_OUTPUT_DIR, exist_ok=True)
 
-    # Process all image files in the templates directory
-    for filename in os.listdir(IMAGE_TEMPLATES_DIR):
-        if filename.lower().endswith(('.png', '.jpg', '.jpeg', '.webp', '.pdf')):
-            image_path = os.path.join(IMAGE_TEMPLATES_DIR, filename)
-            generate_ocr_json_from_image(image_path, OCR_JSON_OUTPUT_DIR) 
\ No newline at end of file
+    # Process all image files in the templates directory; PDFs can't be decoded
+    # here, so they are skipped
+    image_paths = [
+        os.path.join(IMAGE_TEMPLATES_DIR, filename)
+        for filename in os.listdir(IMAGE_TEMPLATES_DIR)
+        if filename.lower().endswith(('.png', '.jpg', '.jpeg', '.webp'))
+    ]
+    generate_ocr_jsons(image_paths, OCR_JSON_OUTPUT_DIR, workers=max(1, args.workers), compress=args.gzip)
@@ -1,11 +1,43 @@
 import os
-import json
+import numpy as np
 import torch
 from transformers import LayoutLMv3ForTokenClassification, LayoutLMv3Processor, TrainingArguments, Trainer, LayoutLMv3Config
-from dataset import LayoutLMv3Dataset
+from dataset import LayoutLMv3Dataset, _load_json, load_labels
 from train import collate_fn
 import safetensors.torch # Import safetensors
 
+def extract_entities(predictions, input_ids, id2label, tokenizer):
+    """
+    Group predicted token labels into entity spans and decode each span's ids in
+    one call. A span is a run of tokens of the same entity type; a "B-" label
+    always starts a new one. Returns {entity type: [text, ...]}.
+    """
+    predictions = np.asarray(predictions)
+    input_ids = np.asarray(input_ids)
+
+    # Per label id: the entity type it belongs to (0 for "O") and whether it is a "B-" tag
+    label_names = [id2label[i] for i in range(len(id2label))]
+    label_entity_types = ["" if name == "O" else name[2:] if name[:2] in ("B-", "I-") else name
+                          for name in label_names]
+    entity_types = [""] + sorted(set(label_entity_types) - {""})
+    type_index = {entity_type: i for i, entity_type in enumerate(entity_types)}
+    label_type = np.array([type_index[entity_type] for entity_type in label_entity_types])
+    label_begins = np.array([name.startswith("B-") for name in label_names])
+
+    types = label_type[predictions]
+    type_changes = types != np.concatenate(([0], types[:-1]))
+    starts = np.flatnonzero((types != 0) & (label_begins[predictions] | type_changes))
+    # A span runs until the next type change or the next span start
+    breaks = np.flatnonzero(type_changes | np.isin(np.arange(len(types)), starts))
+    ends = np.append(breaks, len(types))[np.searchsorted(breaks, starts, side="right")]
+
+    entities = {}
+    for start, end in zip(starts.tolist(), ends.tolist()):
+        text = tokenizer.decode(input_ids[start:end].tolist(), skip_special_tokens=True).strip()
+        if text:
+            entities.setdefault(entity_types[types[start]], []).append(text)
+    return entities
+
 def test_training_setup():
     # Setup absolute paths
     current_dir = os.path.dirname(os.path.abspath(__file__))
@@ -65,14 +97,8 @@ def test_inference():
 
     processor = LayoutLMv3Processor.from_pretrained("microsoft/layoutlmv3-base", apply_ocr=False, local_files_only=True)
 
-    # Load the training manifest to get label information for id2label mapping
-    with open(os.path.join(json_dir, "training_manifest.json"), "r") as f:
-        training_manifest = json.load(f)
-
-    unique_classes = set()
-    for item in training_manifest:
-        for region in item["regions"]:
-            unique_classes.add(region["class"])
+    # Label information for the id2label mapping, from the manifest's labels.json cache
+    unique_classes = load_labels(json_dir)["classes"]
 
     # Create label2id mapping, ensuring 'O' (Outside) is always mapped to 0
     label2id = {"O": 0}
@@ -134,8 +160,7 @@ def test_inference():
         file_path = os.path.join(json_dir, json_file)
         print(f"\nProcessing {json_file}...")
         try:
-            with open(file_path, 'r') as f:
-                ocr_json = json.load(f)
+            ocr_json = _load_json(file_path)
             
             # Get the base name without _ocr_json.json
             base_name = json_file.replace('_ocr_json.json', '')
@@ -152,7 +177,7 @@ def test_inference():
                 print(f"Warning: Original image for {json_file} not found in Invoice Templates. Using dummy image.")
             
             from data_utils import ocr_json_to_layoutlm_inputs
-            inputs = ocr_json_to_layoutlm_inputs(ocr_json, image_path=image_path)
+            inputs = ocr_json_to_layoutlm_inputs(ocr_json, image_path=image_path, processor=processor)
 
             if inputs is None or not inputs["input_ids"].numel():
                 print(f"Skipping {json_file} due to empty or invalid input.")
@@ -165,35 +190,9 @@ def test_inference():
 
             predictions = outputs.logits.argmax(dim=-1).squeeze().tolist()
             tokens = inputs["input_ids"].squeeze().tolist()
-            words = processor.tokenizer.convert_ids_to_tokens(tokens)
 
             # Group entities by type
-            entities = {}
-            current_entity = []
-            current_label = None
-
-            for i, (pred_id, token) in enumerate(zip(predictions, words)):
-                if pred_id != label2id["O"] and i < len(words):
-                    label = id2label[pred_id]
-                    
-                    # Handle subword tokens
-                    if token.startswith("##"):
-                        if current_entity:
-                            current_entity.append(token[2:])
-                    else:
-                        if current_entity:
-                            if current_label not in entities:
-                                entities[current_label] = []
-                            entities[current_label].append("".join(current_entity))
-                            current_entity = []
-                        current_label = label
-                        current_entity = [token]
-
-            # Add the last entity if exists
-            if current_entity and current_label:
-                if current_label not in entities:
-                    entities[current_label] = []
-                entities[current_label].append("".join(current_entity))
+            entities = extract_entities(predictions, tokens, id2label, processor.tokenizer)
 
             # Print extracted entities in a structured format
             print("\nExtracted Entities:")
@@ -1,27 +1,19 @@
 import os
-import json
 import torch
-from transformers import LayoutLMv3ForTokenClassification, LayoutLMv3Processor, TrainingArguments, Trainer
-from torch.utils.data import DataLoader
-from dataset import LayoutLMv3Dataset
+from transformers import LayoutLMv3ForTokenClassification, TrainingArguments, Trainer
+from data_utils import get_processor
+from dataset import LayoutLMv3Dataset, collate_fn, load_labels
 
 # Define the path to your JSON and (optional) image directories using absolute paths
 current_dir = os.path.dirname(os.path.abspath(__file__))
 json_dir = current_dir
 image_dir = os.path.join(os.path.dirname(os.path.dirname(current_dir)), "media/invoices")  # Adjust if your image path is different
 
-# Load the training manifest to get label information
-with open(os.path.join(json_dir, "training_manifest.json"), "r") as f:
-    training_manifest = json.load(f)
-
-# Get unique classes from the training manifest
-unique_classes = set()
-for item in training_manifest:
-    for region in item["regions"]:
-        unique_classes.add(region["class"])
+# Get unique classes from the training manifest (cached in labels.json)
+unique_classes = load_labels(json_dir)["classes"]
 
 # Initialize the processor
-processor = LayoutLMv3Processor.from_pretrained("microsoft/layoutlmv3-base", apply_ocr=False)
+processor = get_processor()
 
 # Load the dataset
 dataset = LayoutLMv3Dataset(json_dir=json_dir, image_dir=image_dir, processor=processor)
@@ -31,38 +23,6 @@ label2id = dataset.label2id
 id2label = dataset.id2label
 num_labels = len(label2id)
 
-# Define a data collator that handles labels
-def collate_fn(batch):
-    # Filter out empty samples that might result from processing errors
-    batch = [item for item in batch if item["input_ids"].numel() > 0]
-    
-    if not batch:
-        return None
-
-    # Pad input_ids, attention_mask, bbox, and labels
-    input_ids = [item["input_ids"] for item in batch]
-    attention_mask = [item["attention_mask"] for item in batch]
-    bbox = [item["bbox"] for item in batch]
-    pixel_values = [item["pixel_values"] for item in batch]
-    labels = [item["labels"] for item in batch]
-
-    # Use processor.tokenizer.pad to handle padding
-    padded_inputs = processor.tokenizer.pad(
-        {
-            "input_ids": input_ids,
-            "attention_mask": attention_mask,
-            "bbox": bbox,
-            "labels": labels
-        },
-        padding=True,
-        return_tensors="pt"
-    )
-    
-    # Handle pixel values
-    padded_inputs["pixel_values"] = torch.stack(pixel_values) if pixel_values[0] is not None else None
-
-    return padded_inputs
-
 # Load the model with proper number of labels
 model = LayoutLMv3ForTokenClassification.from_pretrained(
     "microsoft/layoutlmv3-base",
@@ -74,6 +34,10 @@ model = LayoutLMv3ForTokenClassification.from_pretrained(
 # Explicitly set num_labels in the model config to ensure it's saved correctly
 model.config.num_labels = num_labels
 
+# Mixed precision on GPU: bf16 (with TF32 matmuls) on Ampere and newer, fp16 on older cards
+use_cuda = torch.cuda.is_available()
+use_bf16 = use_cuda and torch.cuda.is_bf16_supported()
+
 # Define training arguments
 training_args = TrainingArguments(
     output_dir="./results",
@@ -84,7 +48,17 @@ training_args = TrainingArguments(
     learning_rate=5e-5,
     weight_decay=0.01,
     warmup_steps=500,
-    no_cuda=True if not torch.cuda.is_available() else False
+    no_cuda=True if not use_cuda else False,
+    bf16=use_bf16,
+    fp16=use_cuda and not use_bf16,
+    tf32=True if use_bf16 else None,
+    # The fused AdamW kernel needs CUDA tensors
+    optim="adamw_torch_fused" if use_cuda else "adamw_torch",
+    dataloader_num_workers=max(2, (os.cpu_count() or 1) // 2),
+    # Keep the workers (and the dataset cache each one holds) alive across epochs
+    dataloader_persistent_workers=True,
+    # collate_fn returns plain tensors; the Trainer pins them in the main process
+    dataloader_pin_memory=True
 )
 
 # Initialize Trainer
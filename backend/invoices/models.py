@@ -28,8 +28,6 @@ class Invoice(models.Model):
     uploaded_at = models.DateTimeField(auto_now_add=True)
     status = models.CharField(max_length=50, choices=INVOICE_STATUS_CHOICES, default='pending')
     upload_status = models.CharField(max_length=50, choices=UPLOAD_STATUS_CHOICES, default='uploaded')
-    ocr_data = models.JSONField(null=True, blank=True)
-    ocr_json = models.JSONField(null=True, blank=True)
 
     # Added fields for structured data
     invoice_number = models.CharField(max_length=255, null=True, blank=True)
@@ -40,9 +38,30 @@ class Invoice(models.Model):
     total_tax = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
     grand_total = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
 
+    class Meta:
+        indexes = [
+            # Newest-first listing, overall and per user
+            models.Index(fields=['-uploaded_at'], name='invoice_uploaded_at_idx'),
+            models.Index(fields=['user', '-uploaded_at'], name='invoice_user_uploaded_idx'),
+            models.Index(fields=['status'], name='invoice_status_idx'),
+        ]
+
     def __str__(self):
         return f"Invoice {self.id} - {self.invoice_number or 'N/A'}"
 
+class InvoiceOCR(models.Model):
+    """
+    The OCR output for an invoice. It lives in its own table so the (large) text
+    and Vision JSON are only read by the code that needs them, not by every
+    Invoice query.
+    """
+    invoice = models.OneToOneField(Invoice, on_delete=models.CASCADE, primary_key=True, related_name='ocr')
+    ocr_text = models.TextField(blank=True, default='')
+    ocr_json = models.JSONField(null=True, blank=True)
+
+    def __str__(self):
+        return f"OCR for Invoice {self.invoice_id}"
+
 class LineItem(models.Model):
     invoice = models.ForeignKey(Invoice, on_delete=models.CASCADE, related_name='line_items')
     description = models.TextField()
@@ -53,6 +72,15 @@ class LineItem(models.Model):
     total = models.DecimalField(max_digits=10, decimal_places=2)
     tax_percentage = models.DecimalField(max_digits=5, decimal_places=2, null=True, blank=True)
     tax_amount = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
+    # Hash of the parsed values (see parsers.line_item_fingerprint), so a re-parse
+    # only touches the lines that changed
+    fingerprint = models.CharField(max_length=16, blank=True, default='', db_index=True)
+    # Where the line sits on the invoice; kept rows keep their primary key when a
+    # re-parse moves them, so this (not the id) gives the document order
+    position = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        ordering = ['position']
 
     def __str__(self):
         return f"Line Item {self.id} for Invoice {self.invoice.id}: {self.description}"
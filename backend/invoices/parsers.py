@@ -1,62 +1,100 @@
 from celery import shared_task
-from .models import Invoice, LineItem
+from django.db import OperationalError, transaction
+from .models import Invoice, InvoiceOCR, LineItem
 from .field_parsers import InvoiceFieldParser
+from collections import defaultdict
+import hashlib
 import logging
 
 logger = logging.getLogger(__name__)
 
-@shared_task
-def parse_invoice_data(invoice_id):
+# The LineItem fields a parsed line is built from, in fingerprint order
+_LINE_ITEM_DEFAULTS = {
+    'description': '',
+    'hsn_sac': '',
+    'quantity': 0.0,
+    'rate': 0.0,
+    'taxable_value': 0.0,
+    'total': 0.0,
+    'tax_percentage': None,
+    'tax_amount': None,
+}
+
+def line_item_fingerprint(fields):
+    """Stable 16-hex-digit hash of a parsed line's field values, used to match re-parsed lines."""
+    key = '\x1f'.join(repr(fields[name]) for name in _LINE_ITEM_DEFAULTS)
+    return hashlib.blake2b(key.encode('utf-8'), digest_size=8).hexdigest()
+
+# acks_late: a worker that dies mid-task leaves the message on the queue for another
+# worker; the result is never read, so it isn't stored. Lock timeouts and deadlocks
+# on the select_for_update surface as OperationalError and are retried.
+@shared_task(bind=True, acks_late=True, ignore_result=True,
+             autoretry_for=(OperationalError,), retry_backoff=True, max_retries=3)
+def parse_invoice_data(self, invoice_id):
     """
     Parse the OCR text from an invoice and extract structured data.
     """
     invoice = None # Initialize invoice to None for proper error handling
     try:
-        invoice = Invoice.objects.get(id=invoice_id)
-        if not invoice.ocr_data or not invoice.ocr_data.get('text'):
-            logger.warning(f"No OCR data or text found for invoice {invoice_id}. Setting status to parsing_failed.")
-            # Ensure status is set even if no OCR data
-            if invoice:
-                invoice.status = 'parsing_failed'
-                invoice.save()
-            return False
+        # Lock the row for the whole parse so a concurrent OCR run can't interleave
+        # its own update with ours
+        with transaction.atomic():
+            invoice = Invoice.objects.select_for_update().get(id=invoice_id)
+            ocr = InvoiceOCR.objects.filter(invoice=invoice).first()
+            if not ocr or not ocr.ocr_text:
+                logger.warning(f"No OCR data or text found for invoice {invoice_id}. Setting status to parsing_failed.")
+                # Ensure status is set even if no OCR data
+                if invoice:
+                    invoice.status = 'parsing_failed'
+                    invoice.save()
+                return False
 
-        # Pass both ocr_data (for text) and ocr_json (for structured table data) to the parser
-        parser = InvoiceFieldParser(invoice.ocr_data, invoice.ocr_json)
+            # Pass both ocr_data (for text) and ocr_json (for structured table data) to the parser
+            parser = InvoiceFieldParser({'text': ocr.ocr_text}, ocr.ocr_json)
 
-        # Extract all fields using the parser
-        invoice.invoice_number = parser.parse_invoice_number()
-        invoice.invoice_date = parser.parse_invoice_date()
-        invoice.seller_gstin = parser.parse_seller_gstin()
-        invoice.buyer_name = parser.parse_buyer_name()
-        invoice.buyer_gstin = parser.parse_buyer_gstin()
-        invoice.total_tax = parser.parse_total_tax_amount()
-        invoice.grand_total = parser.parse_grand_total()
+            # Extract all fields using the parser
+            invoice.invoice_number = parser.parse_invoice_number()
+            invoice.invoice_date = parser.parse_invoice_date()
+            invoice.seller_gstin = parser.parse_seller_gstin()
+            invoice.buyer_name = parser.parse_buyer_name()
+            invoice.buyer_gstin = parser.parse_buyer_gstin()
+            invoice.total_tax = parser.parse_total_tax_amount()
+            invoice.grand_total = parser.parse_grand_total()
 
-        # Save the invoice first to ensure we have an ID for the line items
-        invoice.save()
+            # Extract line items and diff them against the stored ones by fingerprint:
+            # unchanged lines are kept (only their position is rewritten if they
+            # moved), only new lines are inserted (in a single INSERT) and only lines
+            # that disappeared are deleted. Re-parsing the same OCR therefore writes
+            # nothing.
+            existing = defaultdict(list)
+            for line_item in invoice.line_items.only('id', 'fingerprint', 'position'):
+                existing[line_item.fingerprint].append(line_item)
 
-        # Clear existing line items
-        invoice.line_items.all().delete()
+            new_line_items = []
+            moved_line_items = []
+            for position, item_data in enumerate(parser.parse_line_items()):
+                fields = {name: item_data.get(name, default) for name, default in _LINE_ITEM_DEFAULTS.items()}
+                fingerprint = line_item_fingerprint(fields)
+                if existing.get(fingerprint):
+                    line_item = existing[fingerprint].pop()
+                    if line_item.position != position:
+                        line_item.position = position
+                        moved_line_items.append(line_item)
+                else:
+                    new_line_items.append(
+                        LineItem(invoice=invoice, fingerprint=fingerprint, position=position, **fields)
+                    )
 
-        # Extract and create line items
-        line_items_data = parser.parse_line_items()
-        for item_data in line_items_data:
-            LineItem.objects.create(
-                invoice=invoice,
-                description=item_data.get('description', ''),
-                hsn_sac=item_data.get('hsn_sac', ''),
-                quantity=item_data.get('quantity', 0.0),
-                rate=item_data.get('rate', 0.0),
-                taxable_value=item_data.get('taxable_value', 0.0),
-                total=item_data.get('total', 0.0),
-                tax_percentage=item_data.get('tax_percentage'),
-                tax_amount=item_data.get('tax_amount'),
-            )
+            stale_ids = [line_item.id for line_items in existing.values() for line_item in line_items]
+            if stale_ids:
+                LineItem.objects.filter(id__in=stale_ids).delete()
+            if moved_line_items:
+                LineItem.objects.bulk_update(moved_line_items, ['position'], batch_size=500)
+            LineItem.objects.bulk_create(new_line_items, batch_size=500)
 
-        # Update status
-        invoice.status = 'parsing_complete'
-        invoice.save()
+            # Update status; the fields and the status go out in one save
+            invoice.status = 'parsing_complete'
+            invoice.save()
 
         logger.info(f"Successfully parsed invoice {invoice_id}")
         return True
@@ -65,6 +103,10 @@ def parse_invoice_data(invoice_id):
         logger.error(f"Invoice {invoice_id} not found")
         return False
     except Exception as e:
+        # Let Celery retry database contention until the last attempt
+        if isinstance(e, OperationalError) and self.request.retries < self.max_retries:
+            logger.warning(f"Database error parsing invoice {invoice_id}, retrying: {e}")
+            raise
         logger.error(f"Error parsing invoice {invoice_id}: {str(e)}", exc_info=True)
         if invoice:
             invoice.status = 'parsing_failed'
@@ -1,15 +1,45 @@
 from rest_framework import serializers
-from .models import Invoice
+from .models import Invoice, LineItem
 from .tasks import run_ocr_on_invoice
 
+
 class InvoiceSerializer(serializers.ModelSerializer):
     class Meta:
         model = Invoice
-        fields = ['id', 'user', 'file', 'uploaded_at', 'ocr_data', 'status']
-        read_only_fields = ['id', 'user', 'uploaded_at', 'ocr_data', 'status']
+        fields = ['id', 'user', 'file', 'uploaded_at', 'status']
+        read_only_fields = ['id', 'user', 'uploaded_at', 'status']
 
     def create(self, validated_data):
         user = self.context['request'].user
         invoice = Invoice.objects.create(user=user, **validated_data)
         run_ocr_on_invoice.delay(invoice.id)
-        return invoice 
\ No newline at end of file
+        return invoice
+
+
+class InvoiceListSerializer(serializers.ModelSerializer):
+    """Summary row for the invoice list; leaves out everything the list doesn't show."""
+    class Meta:
+        model = Invoice
+        fields = ['id', 'file', 'uploaded_at', 'status', 'upload_status', 'invoice_number', 'grand_total']
+        read_only_fields = fields
+
+
+class LineItemSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = LineItem
+        fields = ['id', 'description', 'hsn_sac', 'quantity', 'rate', 'taxable_value', 'total', 'tax_percentage', 'tax_amount']
+        read_only_fields = fields
+
+
+class InvoiceDetailSerializer(serializers.ModelSerializer):
+    """A single invoice with its parsed fields and line items."""
+    line_items = LineItemSerializer(many=True, read_only=True)
+
+    class Meta:
+        model = Invoice
+        fields = [
+            'id', 'user', 'file', 'uploaded_at', 'status', 'upload_status',
+            'invoice_number', 'invoice_date', 'seller_gstin', 'buyer_name', 'buyer_gstin',
+            'total_tax', 'grand_total', 'line_items',
+        ]
+        read_only_fields = fields
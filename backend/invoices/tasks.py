@@ -1,5 +1,6 @@
 from celery import shared_task
-from .models import Invoice
+from celery.utils.time import get_exponential_backoff_interval
+from .models import Invoice, InvoiceOCR
 # from PIL import Image # No longer needed for Google Vision
 # import pytesseract # No longer needed for Google Vision
 from .parsers import parse_invoice_data
@@ -9,67 +10,170 @@ import json
 import logging
 
 # Import Google Cloud Vision libraries
+from google.api_core import exceptions as google_exceptions
 from google.cloud import vision
 from google.protobuf.json_format import MessageToDict
-import io
 
 # Import the InvoiceFieldParser
 from .field_parsers import InvoiceFieldParser
 
 logger = logging.getLogger(__name__)
 
-@shared_task
-def run_ocr_on_invoice(invoice_id):
+# Celery workers are long-lived, so the Vision client (credentials, gRPC channel,
+# TLS session) is built once per worker process and shared; it is thread-safe.
+_vision_client = None
+
+def _get_client():
+    global _vision_client
+    if _vision_client is None:
+        _vision_client = vision.ImageAnnotatorClient()
+    return _vision_client
+
+def _vision_image(image_path):
+    """Build a vision.Image from a file on disk, read in a single call."""
+    with open(image_path, 'rb') as image_file:
+        return vision.Image(content=image_file.read())
+
+# Vision errors that are worth retrying (outages, timeouts, rate limiting)
+_RETRYABLE_VISION_ERRORS = (
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.DeadlineExceeded,
+    google_exceptions.ResourceExhausted,
+    google_exceptions.InternalServerError,
+)
+
+# Vision's images:annotate endpoint accepts at most 16 images per request
+VISION_BATCH_SIZE = 16
+
+def _save_ocr_response(invoice, response):
+    """Store one Vision AnnotateImageResponse on the invoice and queue its parsing."""
+    invoice_id = invoice.id
+
+    # Read the text straight off the proto, and only convert the fullTextAnnotation
+    # subtree to a dict; the per-word textAnnotations (the bulk of the response)
+    # are never used
+    raw_ocr_text = ""
+    full_text_annotation = None
+    if response._pb.HasField('full_text_annotation'):
+        raw_ocr_text = response.full_text_annotation.text
+        full_text_annotation = MessageToDict(response._pb.full_text_annotation)
+
+    # Save raw OCR text to a debug log file (as previously implemented)
+    log_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'ocr_debug_logs')
+    if not os.path.exists(log_dir):
+        os.makedirs(log_dir)
+
+    timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+    log_filename = f"invoice_{invoice_id}_ocr_result_{timestamp}.txt"
+    log_filepath = os.path.join(log_dir, log_filename)
+
+    with open(log_filepath, 'w', encoding='utf-8') as f:
+        f.write(raw_ocr_text)
+    logger.info(f"Raw OCR result saved to: {log_filepath}")
+
+    InvoiceOCR.objects.update_or_create(
+        invoice=invoice,
+        defaults={'ocr_text': raw_ocr_text, 'ocr_json': full_text_annotation}, # Store the fullTextAnnotation part
+    )
+    invoice.status = 'ocr_complete'
+    invoice.save()
+
+    # Trigger the parsing task
+    parse_invoice_data.delay(invoice.id)
+
+# acks_late: a worker that dies mid-task leaves the message on the queue for another
+# worker; the result is never read, so it isn't stored
+@shared_task(bind=True, acks_late=True, ignore_result=True,
+             autoretry_for=_RETRYABLE_VISION_ERRORS, retry_backoff=True, max_retries=3)
+def run_ocr_on_invoice(self, invoice_id):
+    invoice = None # Initialize invoice to None for proper error handling
     try:
         invoice = Invoice.objects.get(id=invoice_id)
         image_path = invoice.file.path
         
         logger.info(f"Attempting to OCR file at path: {image_path} using Google Cloud Vision")
 
-        # Initialize Google Cloud Vision client
-        client = vision.ImageAnnotatorClient()
+        # Reuse this worker's Google Cloud Vision client
+        client = _get_client()
 
         # Load image into memory
-        with io.open(image_path, 'rb') as image_file:
-            content = image_file.read()
-
-        image = vision.Image(content=content)
+        image = _vision_image(image_path)
 
         # Perform OCR using Google Cloud Vision
         response = client.document_text_detection(image=image)
 
-        raw_ocr_text = ""
-        # Convert the entire response object to a dictionary first
-        response_dict = MessageToDict(response._pb)
-
-        if response_dict.get('fullTextAnnotation'):
-            raw_ocr_text = response_dict['fullTextAnnotation']['text']
-        
-        # Save raw OCR text to a debug log file (as previously implemented)
-        log_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'ocr_debug_logs')
-        if not os.path.exists(log_dir):
-            os.makedirs(log_dir)
-        
-        timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-        log_filename = f"invoice_{invoice_id}_ocr_result_{timestamp}.txt"
-        log_filepath = os.path.join(log_dir, log_filename)
-        
-        with open(log_filepath, 'w', encoding='utf-8') as f:
-            f.write(raw_ocr_text)
-        logger.info(f"Raw OCR result saved to: {log_filepath}")
-
-        invoice.ocr_data = {'text': raw_ocr_text}
-        invoice.ocr_json = response_dict.get('fullTextAnnotation') # Store the fullTextAnnotation part
-        invoice.status = 'ocr_complete'
-        invoice.save()
-
-        # Trigger the parsing task
-        parse_invoice_data.delay(invoice.id)
+        _save_ocr_response(invoice, response)
 
     except Invoice.DoesNotExist:
         logger.error(f"Invoice with ID {invoice_id} not found.")
     except Exception as e:
+        # Let Celery retry transient Vision errors until the last attempt
+        if isinstance(e, _RETRYABLE_VISION_ERRORS) and self.request.retries < self.max_retries:
+            logger.warning(f"Transient Vision error for invoice {invoice_id}, retrying: {e}")
+            raise
         logger.error(f"Error performing OCR for invoice {invoice_id}: {e}", exc_info=True)
         if invoice:
             invoice.status = 'ocr_failed'
-            invoice.save() 
\ No newline at end of file
+            invoice.save()
+
+@shared_task(bind=True, acks_late=True, ignore_result=True,
+             autoretry_for=_RETRYABLE_VISION_ERRORS, retry_backoff=True, max_retries=3)
+def run_ocr_on_invoices(self, invoice_ids):
+    """
+    OCR several invoices with as few Vision calls as possible: up to
+    VISION_BATCH_SIZE images go out in a single batch_annotate_images request.
+    """
+    invoices = Invoice.objects.in_bulk(invoice_ids)
+    for invoice_id in invoice_ids:
+        if invoice_id not in invoices:
+            logger.error(f"Invoice with ID {invoice_id} not found.")
+    invoices = [invoices[invoice_id] for invoice_id in invoice_ids if invoice_id in invoices]
+
+    client = _get_client()
+    feature = vision.Feature(type_=vision.Feature.Type.DOCUMENT_TEXT_DETECTION)
+    for start in range(0, len(invoices), VISION_BATCH_SIZE):
+        batch = []
+        requests = []
+        for invoice in invoices[start:start + VISION_BATCH_SIZE]:
+            try:
+                image = _vision_image(invoice.file.path)
+            except Exception as e:
+                logger.error(f"Error reading file for invoice {invoice.id}: {e}", exc_info=True)
+                invoice.status = 'ocr_failed'
+                invoice.save()
+                continue
+            batch.append(invoice)
+            requests.append(vision.AnnotateImageRequest(image=image, features=[feature]))
+        if not requests:
+            continue
+
+        logger.info(f"Sending {len(requests)} invoices to Google Cloud Vision in one batch")
+        try:
+            responses = client.batch_annotate_images(requests=requests).responses
+        except Exception as e:
+            # Let Celery retry transient Vision errors until the last attempt. The retry
+            # only carries this batch and the ones not sent yet, so the invoices this
+            # run already saved aren't OCR'd again
+            if isinstance(e, _RETRYABLE_VISION_ERRORS) and self.request.retries < self.max_retries:
+                remaining_ids = [invoice.id for invoice in batch + invoices[start + VISION_BATCH_SIZE:]]
+                logger.warning(f"Transient Vision error for invoices {[invoice.id for invoice in batch]}, retrying: {e}")
+                # Same schedule as retry_backoff=True
+                countdown = get_exponential_backoff_interval(
+                    factor=1, retries=self.request.retries, maximum=600, full_jitter=True)
+                raise self.retry(args=(remaining_ids,), exc=e, countdown=countdown)
+            logger.error(f"Error performing batch OCR for invoices {[invoice.id for invoice in batch]}: {e}", exc_info=True)
+            for invoice in batch:
+                invoice.status = 'ocr_failed'
+                invoice.save()
+            continue
+
+        # Responses come back in request order
+        for invoice, response in zip(batch, responses):
+            try:
+                if response.error.message:
+                    raise RuntimeError(response.error.message)
+                _save_ocr_response(invoice, response)
+            except Exception as e:
+                logger.error(f"Error performing OCR for invoice {invoice.id}: {e}", exc_info=True)
+                invoice.status = 'ocr_failed'
+                invoice.save()
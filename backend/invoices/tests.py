@@ -1,3 +1,162 @@
-from django.test import TestCase
+import re
+import unittest
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.test import SimpleTestCase, TestCase
+from django.urls import reverse
+from google.api_core import exceptions as google_exceptions
+from rest_framework.test import APIClient
+
+from . import field_parsers, tasks
+from .field_parsers import InvoiceFieldParser
+from .models import Invoice, InvoiceOCR
+from .parsers import parse_invoice_data
+from .serializers import InvoiceDetailSerializer
+
+try:
+    import pcre2
+except ImportError:
+    pcre2 = None
+
+# A header spread over several lines followed by one line item row
+MULTILINE_INVOICE_TEXT = (
+    "TAX INVOICE\n"
+    "Invoice No: INV-2023/001\n"
+    "GSTIN: 27ABCDE1234F1Z5\n"
+    "1 Widget 8471 2 100.00 200.00 18 236.00"
+)
+
+
+class FieldPatternTests(SimpleTestCase):
+    def test_invoice_number_label_and_value_on_the_same_line(self):
+        parser = InvoiceFieldParser({'text': MULTILINE_INVOICE_TEXT})
+        self.assertEqual(parser.parse_invoice_number(), "INV-2023/001")
+
+    def test_invoice_number_not_taken_from_the_next_line(self):
+        parser = InvoiceFieldParser({'text': "Tax Invoice\n\nIRN fef1df90406b928db26a62f816debc9bb5256d9375e6-"})
+        self.assertIsNone(parser.parse_invoice_number())
+
+    def test_fused_patterns_never_span_lines(self):
+        from debug_parsing import raw_ocr_text
+
+        for pattern in field_parsers._SCANNED_PATTERNS:
+            for text in (MULTILINE_INVOICE_TEXT, raw_ocr_text):
+                for match in pattern.finditer(text):
+                    self.assertNotIn("\n", match.group(0), pattern.pattern)
+
+    def test_buyer_gstin_is_the_first_gstin_that_is_not_the_sellers(self):
+        text = (
+            "GSTIN: 27ABCDE1234F1Z5\n"
+            "Consignee GSTIN: 29PQRST5678K1Z2\n"
+            "Buyer GSTIN: 07LMNOP9012Q1Z8"
+        )
+        parser = InvoiceFieldParser({'text': text})
+        self.assertEqual(parser.parse_seller_gstin(), "27ABCDE1234F1Z5")
+        self.assertEqual(parser.parse_buyer_gstin(), "29PQRST5678K1Z2")
+
+    def test_captures_are_upper_cased(self):
+        text = (
+            "Invoice No: inv-2023/001\n"
+            "GSTIN: 27abcde1234f1z5\n"
+            "Buyer GSTIN: 29pqrst5678k1z2"
+        )
+        parser = InvoiceFieldParser({'text': text})
+        self.assertEqual(parser.parse_invoice_number(), "INV-2023/001")
+        self.assertEqual(parser.parse_seller_gstin(), "27ABCDE1234F1Z5")
+        self.assertEqual(parser.parse_buyer_gstin(), "29PQRST5678K1Z2")
+
+
+class LineItemPatternTests(SimpleTestCase):
+    def _line_items(self, compiled):
+        return [match.groups() for match in compiled.finditer(MULTILINE_INVOICE_TEXT)]
+
+    def test_stdlib_re_keeps_each_match_on_one_line(self):
+        compiled = re.compile(field_parsers._LINE_ITEM_PATTERN, re.IGNORECASE | re.MULTILINE)
+        items = self._line_items(compiled)
+        self.assertEqual(len(items), 1)
+        self.assertEqual(items[0][1:3], ("Widget", "8471"))
+
+    @unittest.skipIf(pcre2 is None, "pcre2 is not installed")
+    def test_pcre2_matches_like_stdlib_re(self):
+        stdlib = re.compile(field_parsers._LINE_ITEM_PATTERN, re.IGNORECASE | re.MULTILINE)
+        jit = pcre2.compile(field_parsers._LINE_ITEM_PATTERN, pcre2.IGNORECASE | pcre2.MULTILINE, jit=True)
+        self.assertEqual(self._line_items(jit), self._line_items(stdlib))
+
+    def test_parser_line_items(self):
+        items = InvoiceFieldParser({'text': MULTILINE_INVOICE_TEXT}).parse_line_items()
+        self.assertEqual(len(items), 1)
+        self.assertEqual(items[0]["description"], "Widget")
+        self.assertEqual(items[0]["hsn_sac"], "8471")
+        self.assertEqual(items[0]["quantity"], 2.0)
+        self.assertEqual(items[0]["rate"], 100.0)
+        self.assertEqual(items[0]["taxable_value"], 200.0)
+
+
+class BatchOcrRetryTests(TestCase):
+    def setUp(self):
+        user = User.objects.create_user(username='ocr', password='ocr')
+        self.invoices = [Invoice.objects.create(user=user, file=f'invoices/{n}.png') for n in range(4)]
+        # Bulk re-OCR: every invoice already has OCR from an earlier run
+        for invoice in self.invoices:
+            InvoiceOCR.objects.create(invoice=invoice, ocr_text='old')
+
+    def _batch_result(self, size):
+        return mock.Mock(responses=[mock.Mock(error=mock.Mock(message='')) for _ in range(size)])
+
+    def test_retry_ocrs_the_failed_batch_and_the_ones_after_it(self):
+        client = mock.Mock()
+        client.batch_annotate_images.side_effect = [
+            self._batch_result(2),
+            google_exceptions.ServiceUnavailable('Vision is down'),
+            self._batch_result(2),
+        ]
+        with mock.patch.object(tasks, 'VISION_BATCH_SIZE', 2), \
+                mock.patch.object(tasks, '_get_client', return_value=client), \
+                mock.patch.object(tasks, '_vision_image', return_value=tasks.vision.Image(content=b'')), \
+                mock.patch.object(tasks, '_save_ocr_response') as save_ocr_response:
+            tasks.run_ocr_on_invoices.apply(args=([invoice.id for invoice in self.invoices],))
+
+        saved = [call.args[0].id for call in save_ocr_response.call_args_list]
+        self.assertEqual(saved, [invoice.id for invoice in self.invoices])
+        self.assertEqual(client.batch_annotate_images.call_count, 3)
+        for invoice in self.invoices:
+            invoice.refresh_from_db()
+            self.assertNotEqual(invoice.status, 'ocr_failed')
+
+
+class InvoiceListViewTests(TestCase):
+    def test_list_is_a_single_query(self):
+        user = User.objects.create_user(username='lister', password='lister')
+        for n in range(5):
+            Invoice.objects.create(user=user, file=f'invoices/{n}.png')
+        client = APIClient()
+        client.force_authenticate(user=user)
+
+        with self.assertNumQueries(1):
+            response = client.get(reverse('invoice-list'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data), 5)
+
+
+class LineItemReparseTests(TestCase):
+    def _parse(self, invoice, rows):
+        InvoiceOCR.objects.update_or_create(invoice=invoice, defaults={'ocr_text': "\n".join(rows)})
+        parse_invoice_data.apply(args=(invoice.id,))
+        invoice = Invoice.objects.prefetch_related('line_items').get(id=invoice.id)
+        return [line['description'] for line in InvoiceDetailSerializer(invoice).data['line_items']]
+
+    def test_corrected_line_keeps_its_place(self):
+        user = User.objects.create_user(username='parser', password='parser')
+        invoice = Invoice.objects.create(user=user, file='invoices/lines.png')
+        rows = [
+            "1 Widget 8471 2 100.00 200.00 18 236.00",
+            "2 Gadget 8517 1 50.00 50.00 18 59.00",
+            "3 Gizmo 8543 4 10.00 40.00 18 47.20",
+        ]
+        self.assertEqual(self._parse(invoice, rows), ["Widget", "Gadget", "Gizmo"])
+
+        kept_ids = set(invoice.line_items.exclude(description="Gadget").values_list('id', flat=True))
+        rows[1] = "2 Sprocket 8517 1 50.00 50.00 18 59.00"
+        self.assertEqual(self._parse(invoice, rows), ["Widget", "Sprocket", "Gizmo"])
+        self.assertTrue(kept_ids <= set(invoice.line_items.values_list('id', flat=True)))
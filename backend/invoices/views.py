@@ -1,7 +1,7 @@
 from django.shortcuts import render
 from rest_framework import generics, permissions
 from .models import Invoice
-from .serializers import InvoiceSerializer
+from .serializers import InvoiceSerializer, InvoiceListSerializer, InvoiceDetailSerializer
 
 # Create your views here.
 
@@ -11,12 +11,24 @@ class InvoiceUploadView(generics.CreateAPIView):
     permission_classes = [permissions.IsAuthenticated]
 
 class InvoiceDetailView(generics.RetrieveAPIView):
-    queryset = Invoice.objects.all()
-    serializer_class = InvoiceSerializer
+    serializer_class = InvoiceDetailSerializer
     permission_classes = [permissions.IsAuthenticated]
 
+    def get_queryset(self):
+        # Line items are fetched in one extra query for the nested representation
+        return self.request.user.invoices.prefetch_related('line_items')
+
 # New view for listing invoices
 class InvoiceListView(generics.ListAPIView):
-    queryset = Invoice.objects.all().order_by('-uploaded_at') # Order by upload time descending
-    serializer_class = InvoiceSerializer
+    serializer_class = InvoiceListSerializer
     permission_classes = [permissions.IsAuthenticated]
+
+    def get_queryset(self):
+        # The user's own invoices, newest first (served by the user/uploaded_at index).
+        # Only the serialized columns are loaded, plus user_id, which the related
+        # manager reads on every row to attach the user.
+        return (
+            self.request.user.invoices
+            .order_by('-uploaded_at')
+            .only('user', *InvoiceListSerializer.Meta.fields)
+        )
@@ -0,0 +1,55 @@
+import os
+import sys
+import django
+import orjson
+from collections import Counter, defaultdict
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
+django.setup()
+
+from invoices import field_parsers
+from invoices.models import InvoiceOCR
+
+# The fused field patterns in field_parsers, keyed by the name used in the report
+PATTERNS = {
+    'invoice_number': field_parsers._INVOICE_NUMBER_RE,
+    'invoice_date': field_parsers._INVOICE_DATE_RE,
+    'seller_gstin': field_parsers._SELLER_GSTIN_RE,
+    'buyer_name': field_parsers._BUYER_NAME_RE,
+    'general_name': field_parsers._GENERAL_NAME_RE,
+    'total_tax': field_parsers._TOTAL_TAX_RE,
+    'grand_total': field_parsers._GRAND_TOTAL_RE,
+    'rupee_symbol': field_parsers._RUPEE_SYMBOL_PATTERNS[0],
+    'rupee_label': field_parsers._RUPEE_SYMBOL_PATTERNS[1],
+}
+
+def profile_field_patterns():
+    """
+    Count, over every stored invoice, how often each field pattern matches and
+    which label (the text in front of the captured value) it matched on.
+    """
+    hits = Counter()
+    labels = defaultdict(Counter)
+    texts = InvoiceOCR.objects.values_list('ocr_text', flat=True)
+    total = 0
+    for text in texts.iterator():
+        total += 1
+        for name, pattern in PATTERNS.items():
+            match = pattern.search(text)
+            if match:
+                hits[name] += 1
+                label = ' '.join(text[match.start():match.start(1)].split()).upper()
+                labels[name][label] += 1
+    return {
+        'invoices': total,
+        'fields': {
+            name: {'hits': hits[name], 'labels': dict(labels[name].most_common())}
+            for name in PATTERNS
+        },
+    }
+
+if __name__ == '__main__':
+    # Prints a JSON histogram used to decide the order of the alternatives in
+    # field_parsers when a layout starts matching the wrong label.
+    sys.stdout.buffer.write(orjson.dumps(profile_field_patterns(), option=orjson.OPT_INDENT_2))
+    sys.stdout.buffer.write(b'\n')